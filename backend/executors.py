@@ -0,0 +1,87 @@
+# backend/executors.py
+
+import asyncio
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import torch
+
+
+def _allowed_cpus():
+    """Logical CPUs this process may run on (affinity / cpuset aware where supported)."""
+    try:
+        return set(os.sched_getaffinity(0))
+    except (AttributeError, OSError):
+        return set(range(os.cpu_count() or 1))
+
+
+def _cpuinfo_physical_cores(allowed) -> int:
+    """Distinct (socket, core) pairs among `allowed` CPUs, from /proc/cpuinfo (Linux)."""
+    try:
+        with open("/proc/cpuinfo") as f:
+            blocks = f.read().strip().split("\n\n")
+    except OSError:
+        return 0
+    cores = set()
+    for block in blocks:
+        info = {}
+        for line in block.splitlines():
+            key, _, value = line.partition(":")
+            info[key.strip()] = value.strip()
+        if "processor" not in info or "core id" not in info:
+            continue
+        if int(info["processor"]) in allowed:
+            cores.add((info.get("physical id", "0"), info["core id"]))
+    return len(cores)
+
+
+def physical_core_count() -> int:
+    """
+    Number of physical CPU cores this process may use, so hyperthread siblings
+    are not counted twice. Reads /proc/cpuinfo against the CPU affinity mask,
+    then psutil if installed, then falls back to the logical count.
+    """
+    allowed = _allowed_cpus()
+    cores = _cpuinfo_physical_cores(allowed)
+    if not cores:
+        try:
+            import psutil
+            cores = min(psutil.cpu_count(logical=False) or 0, len(allowed))
+        except ImportError:
+            cores = 0
+    return cores or len(allowed) or 1
+
+
+PHYSICAL_CORES = physical_core_count()
+
+# Encoder pool: a few workers, each running torch with an equal share of the
+# physical cores, so concurrent forward passes never oversubscribe the CPU.
+ENCODE_WORKERS = max(1, min(int(os.getenv("PLANIT_ENCODE_WORKERS", "1")), PHYSICAL_CORES))
+TORCH_THREADS = max(1, PHYSICAL_CORES // ENCODE_WORKERS)
+
+# Vector-store calls are network bound, post-processing is light NumPy work
+SEARCH_WORKERS = int(os.getenv("PLANIT_SEARCH_WORKERS", "8"))
+POSTPROCESS_WORKERS = int(os.getenv("PLANIT_POSTPROCESS_WORKERS", str(max(1, PHYSICAL_CORES // 2))))
+
+torch.set_num_threads(TORCH_THREADS)
+try:
+    torch.set_num_interop_threads(1)
+except RuntimeError:
+    # Can only be set once, before any inter-op parallel work has started
+    pass
+
+encode_executor = ThreadPoolExecutor(max_workers=ENCODE_WORKERS, thread_name_prefix="planit-encode")
+search_executor = ThreadPoolExecutor(max_workers=SEARCH_WORKERS, thread_name_prefix="planit-search")
+postprocess_executor = ThreadPoolExecutor(max_workers=POSTPROCESS_WORKERS, thread_name_prefix="planit-post")
+
+
+async def run_in(executor: ThreadPoolExecutor, fn, *args, **kwargs):
+    """Run a blocking call on `executor` without blocking the event loop."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor, functools.partial(fn, *args, **kwargs))
+
+
+def shutdown_executors():
+    for executor in (encode_executor, search_executor, postprocess_executor):
+        executor.shutdown(wait=False, cancel_futures=True)
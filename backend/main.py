@@ -2,6 +2,8 @@ from fastapi import FastAPI
 from routers import filters, search
 from fastapi.middleware.cors import CORSMiddleware
 from routers import extract_filters  # Add this import
+from executors import run_in, search_executor, shutdown_executors
+import asyncio
 
 
 
@@ -25,6 +27,16 @@ app.include_router(filters.router, prefix="/api")
 app.include_router(search.router, prefix="/api")
 app.include_router(extract_filters.router, prefix="/api")
 
+@app.on_event("startup")
+async def startup():
+    # Load + warm the searcher in the background; /api/ready reports when it is hot
+    if search.EAGER_STARTUP:
+        app.state.warm_up_task = asyncio.create_task(run_in(search_executor, search.warm_up_searcher))
+
+@app.on_event("shutdown")
+def shutdown():
+    shutdown_executors()
+
 @app.get("/")
 def root():
     return {"message": "PlanIt API is running", "docs": "/docs"}
@@ -0,0 +1,122 @@
+# backend/response_formats.py
+
+import json
+from typing import Dict, Optional
+
+import numpy as np
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# Media types /api/search can answer with, selected from the Accept header
+JSON_MEDIA_TYPE = "application/json"  # list of hit dicts (SearchResponse)
+COLUMNAR_JSON_MEDIA_TYPE = "application/vnd.planit.columnar+json"  # one array per field
+MSGPACK_MEDIA_TYPE = "application/x-msgpack"  # one packed little-endian float32 buffer per field
+
+PACKED_DTYPE = "<f4"
+
+
+def supported_media_types():
+    types = [JSON_MEDIA_TYPE, COLUMNAR_JSON_MEDIA_TYPE]
+    if msgpack is not None:
+        types.append(MSGPACK_MEDIA_TYPE)
+    return types
+
+
+def negotiate_media_type(accept: Optional[str]) -> str:
+    """
+    Pick the response media type from an Accept header (highest q wins,
+    earlier entries win ties). Anything unsupported or refused (q=0) falls
+    back to JSON.
+    """
+    if not accept:
+        return JSON_MEDIA_TYPE
+    supported = supported_media_types()
+    best, best_q = JSON_MEDIA_TYPE, -1.0
+    for entry in accept.split(","):
+        media_type, _, params = entry.strip().partition(";")
+        media_type = media_type.strip().lower()
+        if media_type not in supported:
+            continue
+        q = 1.0
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    pass
+        if q <= 0:
+            continue  # q=0 means "not acceptable"
+        if q > best_q:
+            best, best_q = media_type, q
+    return best
+
+
+def encode_columnar(media_type: str, status: str, query: str, lat: np.ndarray, lng: np.ndarray,
+                    scores: np.ndarray, heatmap_scores: Dict[str, np.ndarray],
+                    fused: Optional[dict] = None) -> bytes:
+    """
+    Serialise a search response as columns instead of one dict per hit:
+
+        {status, query, count, lat, lng, score, heatmap_scores: {amenity: [...]}, fused}
+
+    Same content as SearchResponse (results of the first result set plus the
+    per-amenity heatmap scores), minus the redundant `id`/`path`/`distance`.
+    Missing coordinates are NaN (null in JSON). `fused` (see score_fusion.py)
+    carries lat/lng/score columns and the (n_locations, n_amenities) matrix,
+    row-major, with its shape.
+    """
+    if media_type == MSGPACK_MEDIA_TYPE:
+        def pack(values):
+            return np.ascontiguousarray(values, dtype=PACKED_DTYPE).tobytes()
+
+        fused_body = None
+        if fused is not None:
+            fused_body = {
+                "mode": fused["mode"],
+                "amenities": fused["amenities"],
+                "weights": pack(fused["weights"]),
+                "lat": pack(fused["lat"]),
+                "lng": pack(fused["lng"]),
+                "score": pack(fused["score"]),
+                "matrix": pack(fused["matrix"]),
+                "shape": list(fused["matrix"].shape),
+            }
+        return msgpack.packb({
+            "status": status,
+            "query": query,
+            "count": int(len(scores)),
+            "dtype": PACKED_DTYPE,
+            "lat": pack(lat),
+            "lng": pack(lng),
+            "score": pack(scores),
+            "heatmap_scores": {key: pack(values) for key, values in heatmap_scores.items()},
+            "fused": fused_body,
+        }, use_bin_type=True)
+
+    def column(values):
+        values = np.asarray(values, dtype=np.float64)
+        return np.where(np.isnan(values), None, values).tolist() if np.isnan(values).any() else values.tolist()
+
+    return json.dumps({
+        "status": status,
+        "query": query,
+        "count": int(len(scores)),
+        "lat": column(lat),
+        "lng": column(lng),
+        "score": column(scores),
+        "heatmap_scores": {key: column(values) for key, values in heatmap_scores.items()},
+        "fused": None if fused is None else {
+            "mode": fused["mode"],
+            "amenities": fused["amenities"],
+            "weights": column(fused["weights"]),
+            "lat": column(fused["lat"]),
+            "lng": column(fused["lng"]),
+            "score": column(fused["score"]),
+            "matrix": np.asarray(fused["matrix"], dtype=np.float64).ravel().tolist(),
+            "shape": list(fused["matrix"].shape),
+        },
+    }, separators=(",", ":")).encode("utf-8")
@@ -11,6 +11,7 @@ sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..'))
 
 # Import the function
 from util.match_queries.match_queries import extract_city_and_filters
+from executors import run_in, search_executor
 
 router = APIRouter()
 
@@ -22,12 +23,13 @@ class ExtractResponse(BaseModel):
     filters: Dict[str, Any]
 
 @router.post("/extract", response_model=ExtractResponse)
-def extract_from_prompt(request: ExtractRequest):
+async def extract_from_prompt(request: ExtractRequest):
     """
     Extract city and filters from natural language input using OpenAI model.
     """
     try:
-        result = extract_city_and_filters(request.prompt)
+        # The OpenAI call is network bound; keep it off the event loop
+        result = await run_in(search_executor, extract_city_and_filters, request.prompt)
         return ExtractResponse(city=result.get("city"), filters=result.get("filters", {}))
     except Exception as e:
         print(f"❌ Error in /extract: {e}")
@@ -1,12 +1,15 @@
-from fastapi import APIRouter, HTTPException
-from pydantic import BaseModel
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from fastapi import APIRouter, HTTPException, Request, Response
+from pydantic import BaseModel, Field
 import torch
 import numpy as np
 from pymilvus import connections, Collection
 import os
 from typing import List, Optional
 from dotenv import load_dotenv
-from sklearn.mixture import GaussianMixture
+from scipy.special import ndtri
 
 # Load environment variables
 load_dotenv()
@@ -17,6 +20,16 @@ sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..', 'util'))
 sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..', 'creds'))
 import creds
 from feature_extractors import FeatureExtractorFactory
+from embedding_cache import TextEmbeddingCache
+from micro_batcher import TextMicroBatcher
+from vector_index import BaseSearchBackend, LocalSearchBackend, SearchHits, ZillizSearchBackend
+from mixture_1d import MixtureFitCache, fit_gmm_1d
+from geo import CityBoundsResolver, GeoRegion, build_region
+from sharded_index import ShardedSearchBackend
+from heatmap_grid import MAX_ZOOM, GridCache, aggregate_layers
+from score_fusion import FUSION_MODES, fuse_hits
+from executors import ENCODE_WORKERS, encode_executor, postprocess_executor, run_in, search_executor
+from response_formats import JSON_MEDIA_TYPE, encode_columnar, negotiate_media_type
 
 router = APIRouter()
 
@@ -30,6 +43,22 @@ class SearchRequest(BaseModel):
     gmm_threshold_percentile: Optional[float] = 0.8
     gmm_uniform_score: Optional[float] = 1.0
     gmm_min_samples: Optional[int] = 10
+    # Optional geo bound, most specific wins: polygon > center + radius_m > bbox > city
+    city: Optional[str] = None  # e.g. the city returned by /api/extract
+    bbox: Optional[List[float]] = None  # [min_lat, min_lng, max_lat, max_lng]
+    center: Optional[List[float]] = None  # [lat, lng]
+    radius_m: Optional[float] = None
+    polygon: Optional[List[List[float]]] = None  # [[lat, lng], ...]
+    # Optional server-side fusion of the amenity layers: product | weighted_sum | min
+    fusion: Optional[str] = None
+    # Score every location in the area instead of the top_k nearest (needs a local index)
+    full_field: Optional[bool] = False
+
+
+class HeatmapRequest(SearchRequest):
+    zoom: int = Field(12, ge=0, le=MAX_ZOOM)  # map zoom level; one grid cell ≈ 16 px at this zoom
+    cell_agg: Optional[str] = "mean"  # per cell: mean | max | sum
+    combine: Optional[str] = "mean"  # across amenities: mean | sum | max
 
 
 class SearchResponse(BaseModel):
@@ -37,25 +66,67 @@ class SearchResponse(BaseModel):
     query: str
     results: List[dict]
     heatmap_scores: dict  # 🧠 now correctly a dict of amenity → [scores]
+    # With `fusion`: every amenity's hits aligned by location id, see fused_columns()
+    fused: Optional[dict] = None
 
 class SigLIP2Searcher:
     """Search captions using SigLIP2 text embeddings."""
     
     def __init__(self):
         """Initialize searcher with environment variables."""
+        # Load the model and connect to the vector store in parallel; both are
+        # slow (model download/load vs. Zilliz connect + collection.load())
+        with ThreadPoolExecutor(max_workers=2, thread_name_prefix="planit-init") as pool:
+            model_future = pool.submit(self._load_model)
+            backend_future = pool.submit(self._connect_backend)
+            model_future.result()
+            backend_future.result()
+        
+        # Cache text embeddings so repeated prompts skip the text tower
+        self.text_cache = TextEmbeddingCache(
+            max_entries=int(os.getenv("PLANIT_TEXT_CACHE_SIZE", "4096")),
+            disk_path=os.getenv("PLANIT_TEXT_CACHE_PATH") or None
+        )
+        self.extractor.text_cache = self.text_cache
+        
+        # Coalesce concurrent requests' texts into shared forward passes, run on
+        # the bounded encoder pool (PLANIT_ENCODE_WORKERS batches at a time)
+        self.text_batcher = None
+        if os.getenv("PLANIT_MICRO_BATCHING", "1") == "1":
+            self.text_batcher = TextMicroBatcher(
+                self._encode_texts_now,
+                max_batch_size=int(os.getenv("PLANIT_BATCH_MAX_SIZE", "16")),
+                max_wait_ms=float(os.getenv("PLANIT_BATCH_MAX_WAIT_MS", "5")),
+                executor=encode_executor,
+                max_in_flight=ENCODE_WORKERS
+            )
+
+    def _load_model(self):
+        """Load SigLIP2 model using feature extractor factory."""
+        model_name = "google/siglip2-base-patch16-512"  # Hardcoded model name
+        self.device = torch.device("cpu")  # Force CPU for better compatibility
+        self.extractor = FeatureExtractorFactory.create_extractor(
+            model_name, self.device,
+            text_padding=os.getenv("PLANIT_TEXT_PADDING", "max_length"),  # "longest" is CLIP-only
+            backend=os.getenv("PLANIT_INFERENCE_BACKEND", "eager"),
+            text_only=os.getenv("PLANIT_TEXT_ONLY", "1") == "1"  # search never embeds images
+        )
+
+    def _connect_backend(self):
+        """Pick the vector search backend: "zilliz" (default), "local" or "sharded"."""
         # Get configuration from environment
         zilliz_uri = creds.ZILLIZ_URI
         zilliz_token = creds.ZILLIZ_TOKEN
         collection_name = creds.ZILLIZ_COLLECTION
-        model_name = "google/siglip2-base-patch16-512"  # Hardcoded model name
         
-        # Load SigLIP2 model using feature extractor factory
-        self.device = torch.device("cpu")  # Force CPU for better compatibility
-        self.extractor = FeatureExtractorFactory.create_extractor(model_name, self.device)
-        
-        # Initialize Zilliz connection if credentials are available
         self.collection = None
-        if zilliz_uri and zilliz_token:
+        self.backend: Optional[BaseSearchBackend] = None
+        backend_name = os.getenv("PLANIT_SEARCH_BACKEND", "zilliz").lower()
+        if backend_name == "local":
+            self.backend = self._load_local_backend()
+        elif backend_name == "sharded":
+            self.backend = self._load_sharded_backend()
+        elif zilliz_uri and zilliz_token:
             try:
                 # Connect to Zilliz
                 connections.connect(
@@ -67,86 +138,226 @@ class SigLIP2Searcher:
                 # Load collection
                 self.collection = Collection(collection_name)
                 self.collection.load()
+                self.backend = ZillizSearchBackend(self.collection)
                 print(f"✅ Connected to Zilliz collection: {collection_name}")
             except Exception as e:
                 print(f"⚠️  Failed to connect to Zilliz: {e}")
                 print("Using mock search mode")
         else:
             print("⚠️  Zilliz credentials not found. Using mock search mode")
+
+        # Full-field search needs the embedding matrix in memory; Zilliz
+        # deployments can point PLANIT_DENSE_INDEX at a local copy of the index
+        self.dense_backend: Optional[BaseSearchBackend] = None
+        if self.backend is not None and self.backend.supports_dense_search:
+            self.dense_backend = self.backend
+        elif os.getenv("PLANIT_DENSE_INDEX"):
+            prefix = os.getenv("PLANIT_DENSE_INDEX")
+            try:
+                self.dense_backend = LocalSearchBackend.from_prefix(prefix)
+                print(f"✅ Loaded dense index: {prefix} with {len(self.dense_backend)} embeddings")
+            except Exception as e:
+                print(f"⚠️  Failed to load dense index {prefix}: {e}")
+
+    def warm_up(self):
+        """
+        Run one forward pass and one vector search so lazy kernels, thread pools
+        and the vector store's caches are initialised before real traffic.
+        Bypasses the text cache so its counters only reflect user queries.
+        """
+        embedding = self._encode_texts_now(["warm-up query near a park"], use_cache=False)
+        if isinstance(self.backend, ShardedSearchBackend):
+            # Loading every shard would blow the memory budget; only load the hot ones
+            preload = [p for p in os.getenv("PLANIT_SHARD_PRELOAD", "").split(",") if p]
+            self.backend.preload(preload)
+        elif self.backend is not None:
+            self.backend.search(embedding, 1)
+
+    @staticmethod
+    def _load_local_backend() -> Optional[LocalSearchBackend]:
+        """Open the local index named by PLANIT_LOCAL_INDEX (path prefix)."""
+        prefix = os.getenv("PLANIT_LOCAL_INDEX")
+        if not prefix:
+            print("⚠️  PLANIT_LOCAL_INDEX not set. Using mock search mode")
+            return None
+        try:
+            backend = LocalSearchBackend.from_prefix(
+                prefix, nprobe=int(os.getenv("PLANIT_LOCAL_INDEX_NPROBE", "16"))
+            )
+            mode = "IVF" if backend.ivf is not None else "exact"
+            print(f"✅ Loaded local index ({mode}): {prefix} with {len(backend)} embeddings")
+            return backend
+        except Exception as e:
+            print(f"⚠️  Failed to load local index {prefix}: {e}")
+            return None
+    
+    @staticmethod
+    def _load_sharded_backend() -> Optional[ShardedSearchBackend]:
+        """Open the geohash-sharded index under PLANIT_SHARDED_INDEX (directory)."""
+        root = os.getenv("PLANIT_SHARDED_INDEX")
+        if not root:
+            print("⚠️  PLANIT_SHARDED_INDEX not set. Using mock search mode")
+            return None
+        try:
+            backend = ShardedSearchBackend(
+                root,
+                memory_budget_bytes=int(float(os.getenv("PLANIT_SHARD_MEMORY_MB", "4096")) * (1 << 20)),
+                workers=int(os.getenv("PLANIT_SHARD_WORKERS", "8")),
+                mmap=os.getenv("PLANIT_SHARD_MMAP", "0") == "1",
+                nprobe=int(os.getenv("PLANIT_LOCAL_INDEX_NPROBE", "16"))
+            )
+            print(f"✅ Opened sharded index: {root} with {len(backend.shards)} shards, {len(backend)} embeddings")
+            return backend
+        except Exception as e:
+            print(f"⚠️  Failed to open sharded index {root}: {e}")
+            return None
     
     def encode_text(self, text: str) -> np.ndarray:
         """Encode text to embedding using SigLIP2."""
-        embedding = self.extractor.extract_text_features([text])
-        return embedding.cpu().float().numpy()
+        return self.encode_texts([text])
+
+    def encode_texts(self, texts: List[str]) -> np.ndarray:
+        """Encode a batch of texts to embeddings in a single SigLIP2 forward pass."""
+        if self.text_batcher is not None:
+            return self.text_batcher.encode(texts)
+        return self._encode_texts_now(texts)
+
+    def encode_texts_async(self, texts: List[str]):
+        """Awaitable `encode_texts` for the async pipeline."""
+        if self.text_batcher is not None:
+            # The batcher has its own worker thread; just wait on its future
+            return asyncio.wrap_future(self.text_batcher.submit(texts))
+        return run_in(encode_executor, self._encode_texts_now, texts)
+
+    def _encode_texts_now(self, texts: List[str], use_cache: bool = True) -> np.ndarray:
+        if not use_cache and self.extractor.text_cache is not None:
+            embeddings = self.extractor._encode_text_batch(texts)
+        else:
+            embeddings = self.extractor.extract_text_features(texts)
+        return embeddings.cpu().float().numpy()
     
     def search(self, query_text: str, top_k: int = 50) -> List[dict]:
         """Search for similar captions."""
-        # Generate query embedding using SigLIP2
-        query_embedding = self.encode_text(query_text)
-        
-        if self.collection is not None:
-            # Real Zilliz search
-            search_params = {
-                "metric_type": "IP",  # Inner Product for normalized embeddings
-                "params": {"ef": 128}
+        return self.search_batch([query_text], top_k)[0]
+
+    def search_batch(self, query_texts: List[str], top_k: int = 50) -> List[List[dict]]:
+        """
+        Search for several queries at once.
+
+        All queries are encoded in one forward pass and sent to Zilliz as a single
+        multi-vector search, so the cost no longer scales with one model call and
+        one round trip per query.
+
+        Returns:
+            One list of matches per query, in the same order as `query_texts`.
+        """
+        if not query_texts:
+            return []
+
+        # Generate all query embeddings using SigLIP2 in one batch
+        query_embeddings = self.encode_texts(query_texts)
+        return self.search_embeddings(query_embeddings, top_k)
+
+    def search_embeddings(self, query_embeddings: np.ndarray, top_k: int = 50) -> List[List[dict]]:
+        """Search the vector backend with already-encoded query embeddings."""
+        return [self._format_hits(hits) for hits in self.search_hits(query_embeddings, top_k)]
+
+    def search_hits(self, query_embeddings: np.ndarray, top_k: int = 50,
+                    region: Optional[GeoRegion] = None) -> List[SearchHits]:
+        """
+        Like `search_embeddings`, but returns the raw SearchHits arrays per query.
+        With a `region`, only locations inside it are searched.
+        """
+        if self.backend is None:
+            raise HTTPException(status_code=500, detail="No vector search backend available")
+
+        # Perform search (one result set per query vector)
+        return self.backend.search(query_embeddings, top_k, region=region)
+
+    def dense_hits(self, query_embeddings: np.ndarray,
+                   region: Optional[GeoRegion] = None) -> List[SearchHits]:
+        """
+        Full-field search: every location (inside `region`) scored against
+        every query in one matrix multiply, no top-k cut. One SearchHits per
+        query, all sharing the same locations in the same order.
+        """
+        if self.dense_backend is None:
+            raise HTTPException(status_code=400,
+                                detail="full_field search needs a local index (PLANIT_DENSE_INDEX)")
+        return self.dense_backend.dense_search(query_embeddings, region=region)
+
+    @staticmethod
+    def _format_hits(hits: SearchHits) -> List[dict]:
+        """Convert one result set into the response match format."""
+        # Coordinates come from the index as vectors; only the dict building is per hit
+        ids = hits.ids.astype(str).tolist()
+        scores = hits.scores.astype(np.float64).tolist()
+        lats, lngs = (np.where(np.isnan(v), None, v).tolist() if np.isnan(v).any() else v.tolist()
+                      for v in (hits.lat, hits.lng))
+        return [
+            {
+                'id': hit_id,
+                'path': None,
+                'score': score,
+                'distance': score,
+                'coordinates': {'lat': lat, 'lng': lng}
             }
-            
-            # Perform search
-            results = self.collection.search(
-    data=query_embedding.tolist(),
-    anns_field="embedding",
-    param=search_params,
-    limit=top_k,
-    output_fields=["id"]  # ✅ ONLY include fields that exist in the schema
-)
-            print(results)
-            # Format results
-            matches = []
-            for hits in results:
-                for hit in hits:
-                    # Extract coordinates from ID (format: "lat_lng")
-                    coords = hit.id.split('_')
-                    lat, lng = None, None
-                    if len(coords) >= 2:
-                        try:
-                            lat = float(coords[0])
-                            lng = float(coords[1])
-                        except ValueError:
-                            pass
-                    
-                    matches.append({
-                        'id': hit.id,
-                        'path': hit.entity.get('path'),
-                        'score': float(hit.score),
-                        'distance': float(hit.distance),
-                        'coordinates': {
-                            'lat': lat,
-                            'lng': lng
-                        }
-                    })
-            
-            return matches
-        else:
-            raise HTTPException(status_code=500, detail="Failed to connect to Zilliz")
+            for hit_id, score, lat, lng in zip(ids, scores, lats, lngs)
+        ]
+
+# Build and warm the searcher at app startup instead of on the first request
+EAGER_STARTUP = os.getenv("PLANIT_EAGER_STARTUP", "1") == "1"
 
 # Global searcher instance
 searcher = None
+searcher_lock = threading.Lock()
+searcher_ready = threading.Event()
+searcher_error: Optional[str] = None
 
 def get_searcher():
     """Get or create searcher instance."""
-    global searcher
+    global searcher, searcher_error
     if searcher is None:
-        try:
-            print("🔧 Initializing SigLIP2Searcher...")
-            searcher = SigLIP2Searcher()
-            print("✅ SigLIP2Searcher initialized successfully")
-        except Exception as e:
-            import traceback
-            error_msg = f"Failed to initialize searcher: {str(e)}\n{traceback.format_exc()}"
-            print(f"❌ {error_msg}")
-            raise HTTPException(status_code=500, detail=f"Failed to initialize searcher: {str(e)}")
+        # Only one thread builds the searcher; concurrent callers wait for it
+        with searcher_lock:
+            if searcher is None:
+                try:
+                    print("🔧 Initializing SigLIP2Searcher...")
+                    searcher = SigLIP2Searcher()
+                    searcher_error = None
+                    print("✅ SigLIP2Searcher initialized successfully")
+                except Exception as e:
+                    import traceback
+                    searcher_error = str(e)
+                    error_msg = f"Failed to initialize searcher: {str(e)}\n{traceback.format_exc()}"
+                    print(f"❌ {error_msg}")
+                    raise HTTPException(status_code=500, detail=f"Failed to initialize searcher: {str(e)}")
     return searcher
 
+def warm_up_searcher():
+    """Build the searcher, run a warm-up pass and mark the service ready."""
+    global searcher_error
+    try:
+        searcher_instance = get_searcher()
+        print("🔥 Warming up searcher...")
+        searcher_instance.warm_up()
+        searcher_ready.set()
+        print("✅ Searcher warm and ready")
+    except Exception as e:
+        searcher_error = getattr(e, "detail", None) or str(e)
+        print(f"❌ Searcher warm-up failed: {searcher_error}")
+
+# City name -> bounding box for geo-bounded searches (cached, see util/geo.py)
+city_resolver = CityBoundsResolver(api_key=getattr(creds, "GOOGLE_MAPS_API_KEY", None))
+
+def resolve_region(request: SearchRequest) -> Optional[GeoRegion]:
+    """Geo bound of a search request, or None for the whole collection."""
+    try:
+        return build_region(bbox=request.bbox, center=request.center, radius_m=request.radius_m,
+                            polygon=request.polygon, city=request.city, city_resolver=city_resolver)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid geo bound: {e}")
+
 def apply_softmax(scores: List[float], temperature: float = 1.0) -> List[float]:
     """Apply softmax to scores for heatmap visualization."""
     if not scores:
@@ -164,6 +375,10 @@ def apply_softmax(scores: List[float], temperature: float = 1.0) -> List[float]:
     
     return softmax_scores.tolist()
 
+# GMM fits memoised by a fingerprint of the scores, so a repeat of the same
+# result set (e.g. a heatmap re-render) skips EM; the fit only depends on the scores
+gmm_fits = MixtureFitCache()
+
 def apply_gmm_filtering(scores: List[float], n_components: int = 3, 
                        threshold_percentile: float = 0.8, uniform_score: float = 1.0,
                        min_samples: int = 10) -> List[float]:
@@ -183,121 +398,263 @@ def apply_gmm_filtering(scores: List[float], n_components: int = 3,
     if not scores or len(scores) < min_samples:
         return scores
     
-    scores_array = np.array(scores).reshape(-1, 1)
+    scores_array = np.asarray(scores, dtype=np.float64)
     
     try:
-        # Fit Gaussian Mixture Model
-        gmm = GaussianMixture(n_components=n_components, random_state=42)
-        gmm.fit(scores_array)
+        # Fit a 1-D Gaussian Mixture Model (deterministic, reused for identical scores)
+        fingerprint = MixtureFitCache.fingerprint(scores_array, n_components)
+        params = gmm_fits.get(fingerprint)
+        if params is None:
+            params = fit_gmm_1d(scores_array, n_components=n_components)
+            gmm_fits.put(fingerprint, params)
+        weights, means, variances = params
         
         # Find the component with the highest mean (highest scoring cluster)
-        component_means = gmm.means_.flatten()
-        highest_component_idx = np.argmax(component_means)
+        highest_component_idx = np.argmax(means)
         
         # Get the mean and std of the highest component
-        highest_mean = component_means[highest_component_idx]
-        highest_std = np.sqrt(gmm.covariances_[highest_component_idx][0, 0])
+        highest_mean = means[highest_component_idx]
+        highest_std = np.sqrt(variances[highest_component_idx])
         
-        # Calculate threshold based on percentile within the highest component
-        threshold = highest_mean + (highest_std * np.percentile(
-            np.random.normal(0, 1, 1000), threshold_percentile * 100
-        ))
+        # Calculate threshold at the requested quantile of the highest component
+        threshold = highest_mean + highest_std * ndtri(threshold_percentile)
         
         # Create filtered scores
-        filtered_scores = []
-        for score in scores:
-            if score >= threshold:
-                filtered_scores.append(uniform_score)
-            else:
-                filtered_scores.append(0.0)
+        keep = scores_array >= threshold
+        filtered_scores = np.where(keep, uniform_score, 0.0)
         
-        print(f"🔬 GMM Filtering: {sum(1 for s in filtered_scores if s > 0)}/{len(scores)} locations kept above threshold {threshold:.4f}")
-        return filtered_scores
+        print(f"🔬 GMM Filtering: {int(keep.sum())}/{len(scores)} locations kept above threshold {threshold:.4f}")
+        return filtered_scores.tolist()
         
     except Exception as e:
         print(f"⚠️ GMM filtering failed: {e}. Using original scores.")
         return scores
 
+def postprocess_scores(scores: np.ndarray, request: SearchRequest) -> List[float]:
+    """Softmax (and optionally GMM-filter) the scores of one result set."""
+    scores = np.asarray(scores, dtype=np.float64).tolist()
+    soft_scores = apply_softmax(scores, temperature=request.softmax_temperature)
+    
+    # Apply GMM filtering if enabled
+    if request.gmm_enabled:
+        soft_scores = apply_gmm_filtering(
+            soft_scores,
+            n_components=request.gmm_n_components,
+            threshold_percentile=request.gmm_threshold_percentile,
+            uniform_score=request.gmm_uniform_score,
+            min_samples=request.gmm_min_samples
+        )
+    return soft_scores
+
+def postprocess_all(batched_hits: List[SearchHits], request: SearchRequest) -> List[List[float]]:
+    return [postprocess_scores(hits.scores, request) for hits in batched_hits]
+
+def fuse_layers(request: SearchRequest, keys: List[str], batched_hits: List[SearchHits],
+                heatmap_scores: dict) -> Optional[dict]:
+    """Aligned amenity matrix + combined score, when the request asks for fusion."""
+    if not request.fusion:
+        return None
+    if request.fusion not in FUSION_MODES:
+        raise HTTPException(status_code=400, detail=f"Unsupported fusion mode: {request.fusion}")
+    return fuse_hits(keys, batched_hits, heatmap_scores, filters=request.filters, mode=request.fusion)
+
+def fused_columns(fused: dict) -> dict:
+    """JSON form of `fuse_hits` output: plain lists, matrix as one row per location."""
+    def column(values):
+        values = np.asarray(values, dtype=np.float64)
+        return np.where(np.isnan(values), None, values).tolist() if np.isnan(values).any() else values.tolist()
+
+    return {
+        "mode": fused["mode"],
+        "amenities": fused["amenities"],
+        "weights": fused["weights"].tolist(),
+        "id": fused["id"].tolist(),
+        "lat": column(fused["lat"]),
+        "lng": column(fused["lng"]),
+        "matrix": fused["matrix"].tolist(),
+        "score": fused["score"].tolist(),
+    }
+
+def encode_columnar_response(media_type: str, query: str, hits: SearchHits,
+                             heatmap_scores: dict, fused: Optional[dict] = None) -> bytes:
+    """Columnar body (see response_formats.py) for the first result set."""
+    return encode_columnar(media_type, "success", query, hits.lat, hits.lng, hits.scores, heatmap_scores,
+                           fused=fused)
+
+async def resolve_region_async(request: SearchRequest) -> Optional[GeoRegion]:
+    # City lookups may hit the geocoder, so resolve the region off the loop
+    region = await run_in(search_executor, resolve_region, request)
+    if region is not None:
+        print(f"🗺️  Restricting search to {region}")
+    return region
+
+async def run_search_pipeline(request: SearchRequest, region: Optional[GeoRegion]):
+    """
+    Encode -> search -> softmax/GMM for every amenity sub-query of `request`.
+
+    Returns (keys, batched_hits, heatmap_scores): the amenity keys, one
+    SearchHits per key, and {key: post-processed scores aligned to its hits}.
+    """
+    print(f"🔍 Received search request: query='{request.query}', filters={request.filters}")
+
+    searcher_instance = await run_in(search_executor, get_searcher)
+
+    if request.filters:
+        # Build every amenity sub-query up front so they share one encoder pass
+        keys = list(request.filters.keys())
+        subqueries = [f"{request.query} near {amenity}" for amenity in keys]
+        for amenity, subquery in zip(keys, subqueries):
+            print(f"🔎 Searching for amenity '{amenity}' → {subquery}")
+    else:
+        # Fallback: no filters, basic search
+        keys = ["default"]
+        subqueries = [request.query]
+
+    # Stage 1: encode all sub-queries in one forward pass (shared with
+    # other in-flight requests when micro-batching is enabled)
+    query_embeddings = await searcher_instance.encode_texts_async(subqueries)
+
+    # Stage 2: one batched vector search (or one dense GEMM over the whole area)
+    if request.full_field:
+        batched_hits = await run_in(search_executor, searcher_instance.dense_hits,
+                                    query_embeddings, region)
+    else:
+        batched_hits = await run_in(search_executor, searcher_instance.search_hits,
+                                    query_embeddings, request.top_k, region)
+
+    # Stage 3: softmax + GMM post-processing
+    all_soft_scores = await run_in(postprocess_executor, postprocess_all,
+                                   batched_hits, request)
+    return keys, batched_hits, dict(zip(keys, all_soft_scores))
+
 @router.post("/search", response_model=SearchResponse)
-def search_locations(request: SearchRequest):
+async def search_locations(request: SearchRequest, http_request: Request):
     """
     Perform one search per active amenity filter and return per-amenity heatmap scores.
+
+    The request runs as a pipeline over dedicated pools: text encoding on the
+    encoder pool, vector search on the search pool, softmax/GMM on the
+    post-processing pool. The event loop never blocks on model or network work.
+
+    The response format follows the Accept header: JSON hit dicts by default,
+    or columnar JSON / packed msgpack (see response_formats.py) for large top_k.
     """
     try:
-        print(f"🔍 Received search request: query='{request.query}', filters={request.filters}")
+        media_type = negotiate_media_type(http_request.headers.get("accept"))
 
-        searcher_instance = get_searcher()
-        all_results = []
-        all_scores = {}
-
-        if request.filters:
-            # Run search per amenity
-            for amenity, distance in request.filters.items():
-                subquery = f"{request.query} near {amenity}"
-                print(f"🔎 Searching for amenity '{amenity}' → {subquery}")
-
-                # Perform search
-                results = searcher_instance.search(subquery, request.top_k)
-                scores = [r["score"] for r in results]
-                soft_scores = apply_softmax(scores, temperature=request.softmax_temperature)
-                
-                # Apply GMM filtering if enabled
-                if request.gmm_enabled:
-                    soft_scores = apply_gmm_filtering(
-                        soft_scores,
-                        n_components=request.gmm_n_components,
-                        threshold_percentile=request.gmm_threshold_percentile,
-                        uniform_score=request.gmm_uniform_score,
-                        min_samples=request.gmm_min_samples
-                    )
-
-                # Save scores by amenity
-                all_scores[amenity] = soft_scores
-
-                # Just grab first result set for now (all results assumed same structure)
-                if not all_results:
-                    all_results = results
-
-            return SearchResponse(
-                status="success",
-                query=request.query,
-                results=all_results,
-                heatmap_scores=all_scores
-            )
+        region = await resolve_region_async(request)
+        keys, batched_hits, heatmap_scores = await run_search_pipeline(request, region)
 
-        # Fallback: no filters, basic search
-        results = searcher_instance.search(request.query, request.top_k)
-        scores = [r["score"] for r in results]
-        soft_scores = apply_softmax(scores, temperature=request.softmax_temperature)
-        
-        # Apply GMM filtering if enabled
-        if request.gmm_enabled:
-            soft_scores = apply_gmm_filtering(
-                soft_scores,
-                n_components=request.gmm_n_components,
-                threshold_percentile=request.gmm_threshold_percentile,
-                uniform_score=request.gmm_uniform_score,
-                min_samples=request.gmm_min_samples
-            )
+        # Optional stage 4: align the amenity layers by location and fuse them
+        fused = await run_in(postprocess_executor, fuse_layers, request, keys, batched_hits, heatmap_scores)
 
+        if media_type != JSON_MEDIA_TYPE:
+            # Skip per-hit dicts and response-model validation entirely
+            body = await run_in(postprocess_executor, encode_columnar_response,
+                                media_type, request.query, batched_hits[0], heatmap_scores, fused)
+            return Response(content=body, media_type=media_type, headers={"Vary": "Accept"})
+
+        # Just return the first result set for now (all results assumed same structure)
+        results = await run_in(postprocess_executor, SigLIP2Searcher._format_hits, batched_hits[0])
         return SearchResponse(
             status="success",
             query=request.query,
             results=results,
-            heatmap_scores={"default": soft_scores}
+            heatmap_scores=heatmap_scores,
+            fused=fused_columns(fused) if fused is not None else None
         )
 
+    except HTTPException:
+        raise
     except Exception as e:
         import traceback
         error_msg = f"❌ Search error: {str(e)}\n{traceback.format_exc()}"
         print(error_msg)
         raise HTTPException(status_code=500, detail=str(e))
 
+# Aggregated heatmap grids per (request, zoom); scores are deterministic for a
+# given request, so repeated pans/slider moves are served from memory. The TTL
+# bounds how long grids outlive an index refresh (0 disables expiry).
+heatmap_cache = GridCache(
+    max_entries=int(os.getenv("PLANIT_HEATMAP_CACHE_SIZE", "256")),
+    ttl_seconds=float(os.getenv("PLANIT_HEATMAP_CACHE_TTL", "600")) or None
+)
+
+def build_heatmap_grid(request: HeatmapRequest, keys: List[str], batched_hits: List[SearchHits],
+                       heatmap_scores: dict) -> dict:
+    layers = {key: (hits.lat, hits.lng, np.asarray(heatmap_scores[key], dtype=np.float64))
+              for key, hits in zip(keys, batched_hits)}
+    grid = aggregate_layers(layers, request.zoom, cell_agg=request.cell_agg, combine=request.combine)
+
+    def column(values, decimals):
+        return np.round(values, decimals).tolist()
+
+    return {
+        "status": "success",
+        "query": request.query,
+        "zoom": request.zoom,
+        "cell_deg": grid["cell_deg"],
+        "count": int(len(grid["weight"])),
+        "lat": column(grid["lat"], 6),
+        "lng": column(grid["lng"], 6),
+        "weight": column(grid["weight"], 4),
+        "layers": {key: column(values, 4) for key, values in grid["layers"].items()},
+    }
+
+@router.post("/heatmap")
+async def heatmap_grid(request: HeatmapRequest):
+    """
+    Search like /search, then aggregate the per-amenity scores onto a regular
+    lat/lng grid sized for `zoom` and combine the layers per cell.
+
+    Returns one entry per non-empty cell (centre lat/lng, combined weight and
+    per-amenity weights) instead of thousands of raw points.
+    """
+    try:
+        cache_key = request.model_dump_json()
+        cached = heatmap_cache.get(cache_key)
+        if cached is not None:
+            return cached
+
+        region = await resolve_region_async(request)
+        keys, batched_hits, heatmap_scores = await run_search_pipeline(request, region)
+        grid = await run_in(postprocess_executor, build_heatmap_grid,
+                            request, keys, batched_hits, heatmap_scores)
+        heatmap_cache.put(cache_key, grid)
+        return grid
+
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except HTTPException:
+        raise
+    except Exception as e:
+        import traceback
+        print(f"❌ Heatmap error: {str(e)}\n{traceback.format_exc()}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/ready")
+async def readiness_check():
+    """Readiness endpoint: 200 only once the searcher is loaded and warmed up."""
+    if searcher_ready.is_set() or (not EAGER_STARTUP and searcher is not None):
+        return {"status": "ready"}
+    detail = f"Search service not ready: {searcher_error}" if searcher_error else "Search service warming up"
+    raise HTTPException(status_code=503, detail=detail)
+
 @router.get("/health")
-def health_check():
+async def health_check():
     """Health check endpoint."""
     try:
-        searcher_instance = get_searcher()
-        return {"status": "healthy", "message": "Search service is running"}
+        if EAGER_STARTUP and searcher is None and searcher_error is None:
+            # Still loading in the background; liveness should not wait for it
+            return {"status": "healthy", "message": "Search service is starting"}
+        searcher_instance = await run_in(search_executor, get_searcher)
+        return {
+            "status": "healthy",
+            "message": "Search service is running",
+            "text_cache": searcher_instance.text_cache.stats(),
+            "text_batcher": searcher_instance.text_batcher.stats() if searcher_instance.text_batcher else None,
+            "heatmap_cache": heatmap_cache.stats(),
+            "shards": searcher_instance.backend.stats() if isinstance(searcher_instance.backend, ShardedSearchBackend) else None
+        }
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Search service unhealthy: {str(e)}")
@@ -40,6 +40,7 @@ export default function SearchHeatmapWithSliders() {
   const [loading, setLoading] = useState(false);
   const [updateTimeout, setUpdateTimeout] = useState(null);
   const [hasInitialized, setHasInitialized] = useState(false);
+  const [city, setCity] = useState('');
 
   useEffect(() => {
     if (!hasInitialized && location.state?.query) {
@@ -97,6 +98,8 @@ export default function SearchHeatmapWithSliders() {
   };
 
   const callBackendWithCurrentFilters = async (filtersObj, filtersState, cityOverride = null) => {
+    if (cityOverride !== null) setCity(cityOverride || '');
+    const searchCity = cityOverride !== null ? cityOverride : city;
 
     const active = {};
     for (const key in filtersObj) {
@@ -113,6 +116,7 @@ export default function SearchHeatmapWithSliders() {
     top_k: searchConfig.topK,
     softmax_temperature: searchConfig.softmaxTemperature,
     filters: filtersObj, // 🧠 important
+    city: searchCity || null, // restricts the search to the city's bounding box
     gmm_enabled: searchConfig.gmmFiltering.enabled,
     gmm_n_components: searchConfig.gmmFiltering.nComponents,
     gmm_threshold_percentile: searchConfig.gmmFiltering.thresholdPercentile,
@@ -0,0 +1,538 @@
+"""
+Embed the downloaded street-view panoramas into the search index.
+
+    ./images/{lat}_{lon}/pano.jpg  ->  SigLIP2 image embeddings  ->  Zilliz / local index
+
+Stages:
+  1. decode + preprocess in a process pool (JPEG decode, optional heading crops,
+     resize to the model's input resolution)
+  2. batched `extract_image_features` calls; views of one location are
+     mean-pooled into a single embedding
+  3. bulk upserts in large chunks, on a background thread so the next chunk is
+     embedded while the previous one is written
+
+Progress is checkpointed in a sqlite state file next to the output, so an
+interrupted run resumes where it stopped.
+
+`--incremental` diffs the image store (directories + metadata.json pano_id/date)
+against that state and only embeds new or changed panoramas and deletes
+removed ones, instead of re-embedding everything.
+
+Usage:
+    python util/embed_images.py --sink zilliz
+    python util/embed_images.py --sink local --index ./models/index/planit
+    python util/embed_images.py --sink zilliz --incremental
+"""
+import argparse
+import json
+import os
+import sqlite3
+import sys
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import Pool
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+import torch
+from PIL import Image
+from tqdm import tqdm
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from feature_extractors import FeatureExtractorFactory
+from vector_index import COORDINATE_FIELDS, IVFIndex, coordinates_from_ids, save_local_index
+
+DEFAULT_MODEL = "google/siglip2-base-patch16-512"  # must match backend/routers/search.py
+
+# What identifies the panorama behind a location: (pano_id, date, pano.jpg mtime)
+Signature = Tuple[Optional[str], Optional[str], Optional[float]]
+
+
+# --------------------------------------------------------------------------- #
+# Image store
+# --------------------------------------------------------------------------- #
+def scan_image_store(image_folder: str) -> List[Tuple[str, str]]:
+    """(id, pano path) for every `{lat}_{lon}/pano.jpg` in `image_folder`, sorted by id."""
+    items = []
+    for entry in os.scandir(image_folder):
+        if not entry.is_dir() or "_" not in entry.name:
+            continue
+        path = os.path.join(entry.path, "pano.jpg")
+        if os.path.exists(path):
+            items.append((entry.name, path))
+    items.sort()
+    return items
+
+
+def read_signature(pano_path: str) -> Signature:
+    """pano_id / date from the location's metadata.json, plus the pano.jpg mtime"""
+    meta = {}
+    meta_file = os.path.join(os.path.dirname(pano_path), "metadata.json")
+    try:
+        with open(meta_file) as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        pass
+    try:
+        mtime = os.path.getmtime(pano_path)
+    except OSError:
+        mtime = None
+    return meta.get("pano_id") or meta.get("panoId"), meta.get("date"), mtime
+
+
+def read_signatures(items: List[Tuple[str, str]], workers: int = 32) -> Dict[str, Signature]:
+    """Signatures of many locations; small-file reads, so threads are enough"""
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return dict(zip((i for i, _ in items), pool.map(read_signature, (p for _, p in items))))
+
+
+def diff_image_store(current: Dict[str, Signature], indexed: Dict[str, Signature]):
+    """
+    Compare the image store against the indexed state.
+
+    Returns (new, changed, removed, backfill) id lists. A location changed when
+    its pano_id/date differ (or, without metadata, its pano.jpg mtime). Rows
+    indexed before signatures were recorded are not re-embedded, only backfilled.
+    """
+    new, changed, backfill = [], [], []
+    for item_id, sig in current.items():
+        old = indexed.get(item_id)
+        if old is None:
+            new.append(item_id)
+        elif old[0] is None and old[2] is None:
+            backfill.append(item_id)
+        elif sig[0] or old[0]:
+            if sig[:2] != old[:2]:
+                changed.append(item_id)
+        elif sig[2] != old[2]:
+            changed.append(item_id)
+    removed = [i for i in indexed if i not in current]
+    return new, changed, removed, backfill
+
+
+def heading_crops(pano: Image.Image, n_views: int) -> List[Image.Image]:
+    """
+    Cut an equirectangular pano into `n_views` square views around the horizon,
+    one per heading (0, 360/n, ...), wrapping across the 0/360 seam.
+    """
+    if n_views <= 1:
+        return [pano]
+    width, height = pano.size
+    view = width // n_views
+    top = max(0, (height - view) // 2)
+    # Pad with the first view so the last crop can wrap around the seam
+    wrapped = Image.new(pano.mode, (width + view, height))
+    wrapped.paste(pano, (0, 0))
+    wrapped.paste(pano.crop((0, 0, view, height)), (width, 0))
+    offset = view // 2  # centre each view on its heading
+    return [wrapped.crop((x, top, x + view, top + view))
+            for x in (((i * view) - offset) % width for i in range(n_views))]
+
+
+def _load_views(args) -> Tuple[str, Optional[List[np.ndarray]]]:
+    """Pool worker: decode one pano into `n_views` resized uint8 arrays."""
+    item_id, path, n_views, resolution = args
+    try:
+        with Image.open(path) as img:
+            # JPEG draft mode decodes at reduced scale when we only need a small view
+            img.draft("RGB", (resolution * max(1, n_views), resolution))
+            pano = img.convert("RGB")
+        views = [v.resize((resolution, resolution), Image.BICUBIC) for v in heading_crops(pano, n_views)]
+        return item_id, [np.asarray(v) for v in views]
+    except Exception as e:
+        print(f"⚠️  Failed to decode {path}: {e}")
+        return item_id, None
+
+
+# --------------------------------------------------------------------------- #
+# Checkpoint state
+# --------------------------------------------------------------------------- #
+class EmbeddingState:
+    """
+    sqlite record of which ids are in the index, the panorama signature they
+    were embedded from and when, committed only after the sink has durably
+    written them.
+    """
+
+    SIGNATURE_COLUMNS = (("pano_id", "TEXT"), ("date", "TEXT"), ("mtime", "REAL"))
+
+    def __init__(self, path: str):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS indexed (
+                id TEXT PRIMARY KEY,
+                model TEXT NOT NULL,
+                indexed_at REAL NOT NULL
+            )""")
+        # State files written before signatures were tracked
+        columns = {r[1] for r in self.conn.execute("PRAGMA table_info(indexed)")}
+        for name, kind in self.SIGNATURE_COLUMNS:
+            if name not in columns:
+                self.conn.execute(f"ALTER TABLE indexed ADD COLUMN {name} {kind}")
+        self.conn.commit()
+
+    def indexed_ids(self, model: str) -> set:
+        return {r[0] for r in self.conn.execute("SELECT id FROM indexed WHERE model = ?", (model,))}
+
+    def indexed_signatures(self, model: str) -> Dict[str, Signature]:
+        rows = self.conn.execute("SELECT id, pano_id, date, mtime FROM indexed WHERE model = ?", (model,))
+        return {r[0]: tuple(r[1:]) for r in rows}
+
+    def mark_indexed(self, ids: List[str], model: str, signatures: Optional[Dict[str, Signature]] = None):
+        now = time.time()
+        signatures = signatures or {}
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO indexed (id, model, indexed_at, pano_id, date, mtime) VALUES (?, ?, ?, ?, ?, ?)",
+            [(i, model, now) + tuple(signatures.get(i, (None, None, None))) for i in ids]
+        )
+        self.conn.commit()
+
+    def update_signatures(self, model: str, signatures: Dict[str, Signature]):
+        self.conn.executemany(
+            "UPDATE indexed SET pano_id = ?, date = ?, mtime = ? WHERE id = ? AND model = ?",
+            [tuple(sig) + (i, model) for i, sig in signatures.items()]
+        )
+        self.conn.commit()
+
+    def remove(self, ids: List[str], model: str):
+        self.conn.executemany("DELETE FROM indexed WHERE id = ? AND model = ?", [(i, model) for i in ids])
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+
+# --------------------------------------------------------------------------- #
+# Sinks
+# --------------------------------------------------------------------------- #
+class ZillizSink:
+    """
+    Upsert (id, embedding) rows into the collection the search router queries,
+    plus numeric lat/lng when the collection schema has those fields.
+    """
+
+    def __init__(self, upsert_batch: int = 1000):
+        sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'creds'))
+        import creds
+        from pymilvus import connections, Collection
+        connections.connect(alias="default", uri=creds.ZILLIZ_URI, token=creds.ZILLIZ_TOKEN)
+        self.collection = Collection(creds.ZILLIZ_COLLECTION)
+        self.upsert_batch = upsert_batch
+        fields = {field.name for field in self.collection.schema.fields}
+        self.has_coordinates = all(name in fields for name in COORDINATE_FIELDS)
+        if not self.has_coordinates:
+            print("⚠️  Collection has no lat/lng fields; search will parse coordinates from ids")
+        print(f"✅ Connected to Zilliz collection: {creds.ZILLIZ_COLLECTION}")
+
+    def write(self, ids: List[str], embeddings: np.ndarray):
+        lat, lng = coordinates_from_ids(ids)
+        for start in range(0, len(ids), self.upsert_batch):
+            end = start + self.upsert_batch
+            rows = [{"id": i, "embedding": e.tolist()} for i, e in zip(ids[start:end], embeddings[start:end])]
+            if self.has_coordinates:
+                for row, a, b in zip(rows, lat[start:end].tolist(), lng[start:end].tolist()):
+                    row["lat"], row["lng"] = a, b
+            self.collection.upsert(rows)
+
+    def delete(self, ids: List[str]):
+        for start in range(0, len(ids), self.upsert_batch):
+            self.collection.delete(f"id in {json.dumps(ids[start:start + self.upsert_batch])}")
+
+    def finalize(self):
+        self.collection.flush()
+
+
+class LocalIndexSink:
+    """
+    Write to a local index (see vector_index.LocalSearchBackend).
+
+    Chunks (and deletions) are appended as `{prefix}.parts/part-*.npz`;
+    `finalize()` merges them into `{prefix}.embeddings.npy` / `{prefix}.ids.npy`,
+    later parts winning when an id was written more than once, then compacts
+    the parts into one so the next incremental run starts from a single file.
+    """
+
+    def __init__(self, prefix: str, ivf_nlist: int = 0):
+        self.prefix = prefix
+        self.parts_dir = f"{prefix}.parts"
+        self.ivf_nlist = ivf_nlist
+        os.makedirs(self.parts_dir, exist_ok=True)
+
+    def _part_paths(self) -> List[str]:
+        return sorted(os.path.join(self.parts_dir, f) for f in os.listdir(self.parts_dir) if f.endswith(".npz"))
+
+    def _write_part(self, **arrays):
+        paths = self._part_paths()
+        number = int(os.path.basename(paths[-1])[5:11]) + 1 if paths else 0
+        path = os.path.join(self.parts_dir, f"part-{number:06d}.npz")
+        tmp = path + ".tmp"
+        with open(tmp, "wb") as f:
+            np.savez(f, **arrays)
+        os.replace(tmp, path)  # a part either exists completely or not at all
+        return path
+
+    def write(self, ids: List[str], embeddings: np.ndarray):
+        self._write_part(ids=np.asarray(ids, dtype=str), embeddings=embeddings.astype(np.float16))
+
+    def delete(self, ids: List[str]):
+        # A part with ids but no embeddings is a tombstone
+        self._write_part(ids=np.asarray(ids, dtype=str))
+
+    def finalize(self):
+        paths = self._part_paths()
+        if not paths:
+            print("⚠️  Nothing to write")
+            return
+        ids_file, ivf_file = f"{self.prefix}.ids.npy", f"{self.prefix}.ivf.npz"
+        # The index is written after its compacted part, so a single part older
+        # than ids.npy is exactly what the index already holds
+        if (len(paths) == 1 and os.path.exists(ids_file)
+                and os.path.getmtime(ids_file) >= os.path.getmtime(paths[0])
+                and os.path.exists(ivf_file) == bool(self.ivf_nlist)):
+            print("Local index already up to date")
+            return
+        ids, rows, embeddings = [], [], []
+        offset = 0
+        for path in paths:
+            part = np.load(path)
+            part_ids = part["ids"]
+            ids.append(part_ids)
+            if "embeddings" in part.files:
+                embeddings.append(part["embeddings"])
+                rows.append(np.arange(offset, offset + len(part_ids)))
+                offset += len(part_ids)
+            else:
+                rows.append(np.full(len(part_ids), -1))
+        ids, rows = np.concatenate(ids), np.concatenate(rows)
+        embeddings = np.concatenate(embeddings) if embeddings else np.empty((0, 0), dtype=np.float16)
+
+        # Keep the last occurrence of each id, unless that was a deletion
+        _, last = np.unique(ids[::-1], return_index=True)
+        keep = np.sort(len(ids) - 1 - last)
+        keep = keep[rows[keep] >= 0]
+        ids, embeddings = ids[keep], embeddings[rows[keep]]
+
+        if len(paths) > 1:
+            compacted = self._write_part(ids=ids, embeddings=embeddings)
+            for path in paths:
+                os.remove(path)
+            print(f"Compacted {len(paths)} parts into {os.path.basename(compacted)}")
+
+        # An IVF describes the old row layout; never leave one next to new rows
+        if os.path.exists(ivf_file):
+            os.remove(ivf_file)
+        save_local_index(self.prefix, ids, embeddings)
+        if self.ivf_nlist:
+            IVFIndex.train(embeddings, nlist=self.ivf_nlist).save(ivf_file)
+        print(f"✅ Wrote local index {self.prefix} with {len(ids)} embeddings")
+
+
+# --------------------------------------------------------------------------- #
+# Pipeline
+# --------------------------------------------------------------------------- #
+def decode_ahead(pool, tasks, window: int) -> Iterator[Tuple[str, Optional[List[np.ndarray]]]]:
+    """
+    Like `pool.imap(_load_views, tasks)`, but with at most `window` tasks
+    submitted and not yet consumed. imap decodes ahead without limit, so at
+    city scale decoded views pile up in the parent faster than they are embedded.
+    """
+    pending = deque()
+    for task in tasks:
+        if len(pending) >= window:
+            yield pending.popleft().get()
+        pending.append(pool.apply_async(_load_views, (task,)))
+    while pending:
+        yield pending.popleft().get()
+
+
+def embed_locations(extractor, decoded: Iterator[Tuple[str, Optional[List[np.ndarray]]]],
+                    batch_size: int) -> Iterator[Tuple[List[str], np.ndarray]]:
+    """
+    Group decoded locations into batches of about `batch_size` views, run one
+    `extract_image_features` call per batch, and mean-pool views per location.
+    Yields (ids, (n_ids, dim) float32 L2-normalised embeddings).
+    """
+    ids, views, owners = [], [], []
+
+    def run():
+        feats = extractor.extract_image_features([Image.fromarray(v) for v in views])
+        feats = feats.float().cpu().numpy()
+        pooled = np.zeros((len(ids), feats.shape[1]), dtype=np.float32)
+        np.add.at(pooled, owners, feats)
+        pooled /= np.maximum(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12)
+        return list(ids), pooled
+
+    for item_id, item_views in decoded:
+        if item_views is None:
+            continue
+        owners.extend([len(ids)] * len(item_views))
+        ids.append(item_id)
+        views.extend(item_views)
+        if len(views) >= batch_size:
+            yield run()
+            ids, views, owners = [], [], []
+    if ids:
+        yield run()
+
+
+def ingest(image_folder: str, sink, state: EmbeddingState, model_name: str = DEFAULT_MODEL,
+           device: Optional[str] = None, batch_size: int = 64, n_views: int = 1,
+           chunk_size: int = 5000, workers: int = 0, limit: Optional[int] = None,
+           decode_window: int = 512,
+           items: Optional[List[Tuple[str, str]]] = None,
+           signatures: Optional[Dict[str, Signature]] = None) -> int:
+    """
+    Embed every location of `image_folder` not yet in `state` and write it to `sink`.
+    `items` overrides the scan with an explicit (id, path) list.
+    `decode_window` caps how many locations are decoded ahead of the model.
+    Returns the number of locations written.
+    """
+    device = torch.device(device or ("cuda" if torch.cuda.is_available() else "cpu"))
+    state_key = make_state_key(model_name, n_views)
+
+    if items is None:
+        done = state.indexed_ids(state_key)
+        items = [(i, p) for i, p in scan_image_store(image_folder) if i not in done]
+        print(f"{len(done)} locations already indexed, {len(items)} to embed")
+    if limit is not None:
+        items = items[:limit]
+    if not items:
+        return 0
+    if signatures is None:
+        signatures = read_signatures(items)
+
+    # Fork the decode workers before the model (and CUDA) is initialised
+    pool = Pool(workers or max(1, (os.cpu_count() or 2) - 1))
+    extractor = FeatureExtractorFactory.create_extractor(model_name, device)
+    resolution = extractor.input_resolution
+
+    written = 0
+    pending_ids: List[str] = []
+    pending_embeds: List[np.ndarray] = []
+    flush_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="planit-upsert")
+    in_flight = None  # (future, ids) of the chunk being written
+
+    def wait_in_flight():
+        nonlocal in_flight, written
+        if in_flight is not None:
+            future, ids = in_flight
+            future.result()
+            state.mark_indexed(ids, state_key, signatures)  # checkpoint only once it is written
+            written += len(ids)
+            in_flight = None
+
+    def flush():
+        nonlocal pending_ids, pending_embeds, in_flight
+        if not pending_ids:
+            return
+        wait_in_flight()
+        ids, embeds = pending_ids, np.concatenate(pending_embeds)
+        in_flight = (flush_pool.submit(sink.write, ids, embeds), ids)
+        pending_ids, pending_embeds = [], []
+
+    tasks = ((i, p, n_views, resolution) for i, p in items)
+    with pool, tqdm(total=len(items), desc="Embedding") as progress:
+        # Input order, with the workers at most `decode_window` locations ahead of the model
+        decoded = decode_ahead(pool, tasks, max(decode_window, batch_size))
+        for ids, embeds in embed_locations(extractor, decoded, batch_size):
+            pending_ids.extend(ids)
+            pending_embeds.append(embeds)
+            progress.update(len(ids))
+            if len(pending_ids) >= chunk_size:
+                flush()
+        flush()
+        wait_in_flight()
+    flush_pool.shutdown()
+    return written
+
+
+def refresh(image_folder: str, sink, state: EmbeddingState, model_name: str = DEFAULT_MODEL,
+            n_views: int = 1, **ingest_kwargs) -> dict:
+    """
+    Incremental update: embed only new or changed panoramas and delete ids whose
+    location disappeared from the image store. Returns the diff counts.
+    """
+    state_key = make_state_key(model_name, n_views)
+    items = scan_image_store(image_folder)
+    current = read_signatures(items)
+    new, changed, removed, backfill = diff_image_store(current, state.indexed_signatures(state_key))
+    print(f"{len(items)} locations: {len(new)} new, {len(changed)} changed, "
+          f"{len(removed)} removed, {len(backfill)} signatures backfilled")
+
+    if backfill:
+        state.update_signatures(state_key, {i: current[i] for i in backfill})
+    if removed:
+        sink.delete(removed)
+        state.remove(removed, state_key)
+
+    todo = set(new) | set(changed)
+    written = ingest(image_folder, sink, state, model_name=model_name, n_views=n_views,
+                     items=[(i, p) for i, p in items if i in todo], signatures=current, **ingest_kwargs)
+    return {"new": len(new), "changed": len(changed), "removed": len(removed), "written": written}
+
+
+def make_state_key(model_name: str, n_views: int) -> str:
+    return f"{model_name}|views={n_views}"
+
+
+def make_sink(args):
+    if args.sink == "zilliz":
+        return ZillizSink(upsert_batch=args.upsert_batch)
+    return LocalIndexSink(args.index, ivf_nlist=args.ivf_nlist)
+
+
+def build_arg_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Embed ./images panoramas into the search index")
+    parser.add_argument("--images", default="./images", help="Image store ({lat}_{lon}/pano.jpg)")
+    parser.add_argument("--sink", choices=("zilliz", "local"), default="zilliz")
+    parser.add_argument("--index", default=os.getenv("PLANIT_LOCAL_INDEX", "./models/index/planit"),
+                        help="Local index prefix (--sink local)")
+    parser.add_argument("--state", default=None, help="Checkpoint sqlite (default: next to the sink)")
+    parser.add_argument("--model", default=DEFAULT_MODEL)
+    parser.add_argument("--device", default=None)
+    parser.add_argument("--batch-size", type=int, default=64, help="Views per forward pass")
+    parser.add_argument("--views", type=int, default=1, help="Heading crops per pano (1 = whole pano)")
+    parser.add_argument("--chunk-size", type=int, default=5000, help="Locations per sink write / checkpoint")
+    parser.add_argument("--upsert-batch", type=int, default=1000, help="Rows per Zilliz upsert call")
+    parser.add_argument("--workers", type=int, default=0, help="Decode processes (0 = cores - 1)")
+    parser.add_argument("--decode-window", type=int, default=512,
+                        help="Locations decoded ahead of the model at most (bounds memory)")
+    parser.add_argument("--ivf-nlist", type=int, default=0, help="Train an IVF index on finalize (local)")
+    parser.add_argument("--limit", type=int, default=None)
+    parser.add_argument("--incremental", action="store_true",
+                        help="Only embed new/changed panoramas and delete removed ones")
+    return parser
+
+
+def default_state_path(args) -> str:
+    if args.state:
+        return args.state
+    if args.sink == "local":
+        return f"{args.index}.state.sqlite"
+    return os.path.join(args.images, "..", "embedding_state.sqlite")
+
+
+def main():
+    args = build_arg_parser().parse_args()
+    sink = make_sink(args)
+    state = EmbeddingState(default_state_path(args))
+    kwargs = dict(model_name=args.model, device=args.device, batch_size=args.batch_size,
+                  n_views=args.views, chunk_size=args.chunk_size, workers=args.workers, limit=args.limit,
+                  decode_window=args.decode_window)
+    try:
+        if args.incremental:
+            counts = refresh(args.images, sink, state, **kwargs)
+            written = counts["written"]
+        else:
+            written = ingest(args.images, sink, state, **kwargs)
+        sink.finalize()
+        print(f"✅ Embedded {written} locations")
+    finally:
+        state.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,180 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+
+
+def normalize_text(text: str) -> str:
+    """Normalise a prompt the same way the SigLIP extractors do (lower-case, trimmed)."""
+    return " ".join(text.lower().split())
+
+
+def make_cache_key(model_name: str, text: str) -> str:
+    """Content-addressed key: model name + normalised text."""
+    payload = f"{model_name}\x00{normalize_text(text)}".encode("utf-8")
+    return hashlib.sha1(payload).hexdigest()
+
+
+class TextEmbeddingCache:
+    """
+    Two-tier text-embedding cache.
+
+    - In-process LRU bounded by `max_entries`.
+    - Optional sqlite file (`disk_path`) so warm entries survive restarts.
+
+    Embeddings are stored as float32 vectors. All methods are thread-safe.
+    """
+
+    def __init__(self, max_entries: int = 4096, disk_path: Optional[str] = None):
+        self.max_entries = max_entries
+        self.disk_path = disk_path
+        self._lru: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._lock = threading.Lock()
+
+        # Counters
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._encode_seconds = 0.0
+        self._encoded_items = 0
+
+        self._db = None
+        if disk_path:
+            os.makedirs(os.path.dirname(os.path.abspath(disk_path)), exist_ok=True)
+            self._db = sqlite3.connect(disk_path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS text_embeddings ("
+                "key TEXT PRIMARY KEY, dim INTEGER NOT NULL, vec BLOB NOT NULL)"
+            )
+            self._db.commit()
+
+    # ------------------------------------------------------------------ #
+    # Single-tier helpers (caller holds the lock)
+    # ------------------------------------------------------------------ #
+    def _lru_get(self, key: str) -> Optional[np.ndarray]:
+        vec = self._lru.get(key)
+        if vec is not None:
+            self._lru.move_to_end(key)
+        return vec
+
+    def _lru_put(self, key: str, vec: np.ndarray):
+        self._lru[key] = vec
+        self._lru.move_to_end(key)
+        while len(self._lru) > self.max_entries:
+            self._lru.popitem(last=False)
+
+    def _disk_get_many(self, keys: List[str]) -> Dict[str, np.ndarray]:
+        if self._db is None or not keys:
+            return {}
+        found = {}
+        # sqlite caps bound parameters, so query in chunks
+        for start in range(0, len(keys), 500):
+            chunk = keys[start:start + 500]
+            placeholders = ",".join("?" * len(chunk))
+            rows = self._db.execute(
+                f"SELECT key, vec FROM text_embeddings WHERE key IN ({placeholders})", chunk
+            ).fetchall()
+            for key, blob in rows:
+                found[key] = np.frombuffer(blob, dtype=np.float32).copy()
+        return found
+
+    def _disk_put_many(self, items: Dict[str, np.ndarray]):
+        if self._db is None or not items:
+            return
+        self._db.executemany(
+            "INSERT OR REPLACE INTO text_embeddings (key, dim, vec) VALUES (?, ?, ?)",
+            [(key, int(vec.shape[0]), vec.tobytes()) for key, vec in items.items()],
+        )
+        self._db.commit()
+
+    # ------------------------------------------------------------------ #
+    # Public API
+    # ------------------------------------------------------------------ #
+    def get_or_encode(self, model_name: str, texts: List[str],
+                      encode_fn: Callable[[List[str]], np.ndarray]) -> np.ndarray:
+        """
+        Return embeddings for `texts`, calling `encode_fn` only for cache misses.
+
+        Args:
+            model_name: Model checkpoint the embeddings belong to
+            texts: Prompts to embed
+            encode_fn: Batch encoder returning a float32 array of shape (len(misses), dim)
+
+        Returns:
+            Array of shape (len(texts), dim) in the same order as `texts`
+        """
+        keys = [make_cache_key(model_name, t) for t in texts]
+        found: Dict[str, np.ndarray] = {}
+
+        with self._lock:
+            for key in keys:
+                vec = self._lru_get(key)
+                if vec is not None:
+                    found[key] = vec
+            lru_hits = len(found)
+
+            missing = [k for k in dict.fromkeys(keys) if k not in found]
+            from_disk = self._disk_get_many(missing)
+            for key, vec in from_disk.items():
+                self._lru_put(key, vec)
+            found.update(from_disk)
+
+        # Encode unique misses outside the lock so other callers are not blocked
+        miss_texts = {}
+        for key, text in zip(keys, texts):
+            if key not in found and key not in miss_texts:
+                miss_texts[key] = text
+
+        if miss_texts:
+            start = time.perf_counter()
+            encoded = np.asarray(encode_fn(list(miss_texts.values())), dtype=np.float32)
+            elapsed = time.perf_counter() - start
+            new_items = {key: encoded[i].copy() for i, key in enumerate(miss_texts)}
+            found.update(new_items)
+        else:
+            elapsed, new_items = 0.0, {}
+
+        with self._lock:
+            for key, vec in new_items.items():
+                self._lru_put(key, vec)
+            self._disk_put_many(new_items)
+            self.hits += lru_hits
+            self.disk_hits += len(from_disk)
+            self.misses += len(new_items)
+            self._encode_seconds += elapsed
+            self._encoded_items += len(new_items)
+
+        return np.stack([found[key] for key in keys])
+
+    def stats(self) -> dict:
+        """Hit/miss counters plus an estimate of encoder time saved."""
+        with self._lock:
+            served = self.hits + self.disk_hits
+            lookups = served + self.misses
+            avg_encode = self._encode_seconds / self._encoded_items if self._encoded_items else 0.0
+            return {
+                "entries": len(self._lru),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": served / lookups if lookups else 0.0,
+                "avg_encode_seconds": avg_encode,
+                "estimated_seconds_saved": served * avg_encode,
+            }
+
+    def clear(self):
+        """Drop the in-process tier (the disk tier is kept)."""
+        with self._lock:
+            self._lru.clear()
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
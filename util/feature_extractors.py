@@ -1,7 +1,9 @@
+import os
 import re
 from abc import ABC, abstractmethod
 from typing import List
 
+import numpy as np
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
@@ -13,11 +15,19 @@ import torch.nn.functional as F
 class BaseFeatureExtractor(nn.Module, ABC):
     """Abstract base class for image‑ and text‑embedding extractors."""
 
+    # Turned off by the int8 / ONNX inference backends (see FeatureExtractorFactory)
+    autocast_enabled = True
+    inference_backend = "eager"
+
     @abstractmethod
     def extract_image_features(self, images) -> torch.Tensor: ...
     @abstractmethod
     def extract_text_features(self, texts: List[str]) -> torch.Tensor: ...
 
+    def _text_tower(self):
+        """Object whose `get_text_features(**inputs)` runs the text encoder."""
+        return getattr(self, "_onnx_text_tower", None) or self.model
+
     @property
     @abstractmethod
     def feature_dim(self) -> int: ...
@@ -27,6 +37,125 @@ class BaseFeatureExtractor(nn.Module, ABC):
     def input_resolution(self) -> int: ...
 
 
+# --------------------------------------------------------------------------- #
+# Length-aware text encoding (shared by the Hugging Face extractors)
+# --------------------------------------------------------------------------- #
+TEXT_PADDING_MODES = ("max_length", "longest")
+
+
+def _length_buckets(lengths: List[int], granularity: int = 8) -> List[List[int]]:
+    """Group item indices whose lengths round up to the same multiple of `granularity`."""
+    buckets = {}
+    for idx, length in enumerate(lengths):
+        key = -(-length // granularity)
+        buckets.setdefault(key, []).append(idx)
+    return [buckets[k] for k in sorted(buckets)]
+
+
+def _encode_text_length_bucketed(tokenizer, model, texts: List[str], device,
+                                 max_length: int, granularity: int = 8) -> torch.Tensor:
+    """
+    Tokenise without padding, bucket by length, and pad each bucket only to its
+    longest item, so the text transformer does not spend its FLOPs on pad tokens.
+
+    Returns un-normalised text features in the original order of `texts`.
+    """
+    encoded = tokenizer(texts, truncation=True, max_length=max_length)
+    lengths = [len(ids) for ids in encoded["input_ids"]]
+    out = None
+    for bucket in _length_buckets(lengths, granularity):
+        batch = tokenizer.pad({k: [encoded[k][i] for i in bucket] for k in encoded},
+                              padding="longest", return_tensors="pt")
+        batch = {k: v.to(device, non_blocking=True) for k, v in batch.items()}
+        embeds = model.get_text_features(**batch)
+        if out is None:
+            out = embeds.new_empty((len(texts), embeds.shape[-1]))
+        out[bucket] = embeds
+    return out
+
+
+# --------------------------------------------------------------------------- #
+# Text-tower-only loading (no vision weights, no image processor)
+# --------------------------------------------------------------------------- #
+# config.model_type -> (transformers text-model class, output holding the text features)
+TEXT_TOWER_CLASSES = {
+    "clip": ("CLIPTextModelWithProjection", "text_embeds"),
+    "siglip": ("SiglipTextModel", "pooler_output"),
+    "siglip2": ("Siglip2TextModel", "pooler_output"),
+}
+
+
+class _TextOnlyModel(nn.Module):
+    """Text tower exposing the same `get_text_features` call as the full dual-encoder."""
+
+    def __init__(self, text_model, output_key, config):
+        super().__init__()
+        self.text_model, self.output_key, self.config = text_model, output_key, config
+
+    def get_text_features(self, **inputs) -> torch.Tensor:
+        return getattr(self.text_model(**inputs), self.output_key)
+
+    def get_image_features(self, **inputs):
+        raise RuntimeError("Extractor was loaded with text_only=True; no vision tower available")
+
+
+def _safetensors_files(model_name: str) -> List[str]:
+    """Local paths of a checkpoint's safetensors file(s), single or sharded."""
+    import json
+    from huggingface_hub import hf_hub_download
+
+    def fetch(filename):
+        local = os.path.join(model_name, filename)
+        return local if os.path.isdir(model_name) else hf_hub_download(model_name, filename)
+
+    try:
+        with open(fetch("model.safetensors.index.json")) as f:
+            shards = sorted(set(json.load(f)["weight_map"].values()))
+        return [fetch(shard) for shard in shards]
+    except Exception:
+        return [fetch("model.safetensors")]
+
+
+def load_text_tower(model_name: str) -> _TextOnlyModel:
+    """
+    Build only the text tower of a CLIP/SigLIP checkpoint.
+
+    Weights are read with safetensors' memory-mapped loader and assigned to the
+    parameters without a copy, so vision weights are never read and worker
+    processes loading the same file share its page-cache pages.
+    """
+    import transformers
+    from transformers import AutoConfig
+    from safetensors import safe_open
+    try:
+        from transformers.modeling_utils import no_init_weights
+    except ImportError:
+        from contextlib import nullcontext as no_init_weights
+
+    config = AutoConfig.from_pretrained(model_name)
+    if config.model_type not in TEXT_TOWER_CLASSES:
+        raise ValueError(f"Text-only loading is not supported for model type: {config.model_type}")
+    class_name, output_key = TEXT_TOWER_CLASSES[config.model_type]
+
+    # Skip random initialisation: every parameter is overwritten below
+    with no_init_weights():
+        text_model = getattr(transformers, class_name)(config.text_config)
+
+    wanted = set(text_model.state_dict().keys())
+    state = {}
+    for path in _safetensors_files(model_name):
+        with safe_open(path, framework="pt") as f:
+            for key in f.keys():
+                if key in wanted:
+                    state[key] = f.get_tensor(key)
+    # Buffers such as position_ids may legitimately be absent from the checkpoint
+    missing = {name for name, _ in text_model.named_parameters()} - state.keys()
+    if missing:
+        raise ValueError(f"Checkpoint {model_name} is missing text-tower weights: {sorted(missing)[:5]}")
+    text_model.load_state_dict(state, strict=False, assign=True)
+    return _TextOnlyModel(text_model.eval(), output_key, config)
+
+
 # --------------------------------------------------------------------------- #
 # OpenAI CLIP (Hugging Face)
 # --------------------------------------------------------------------------- #
@@ -38,13 +167,24 @@ class OpenAICLIPFeatureExtractor(BaseFeatureExtractor):
         "openai/clip-vit-large-patch14-336": 768,
     }
 
-    def __init__(self, model_name="openai/clip-vit-large-patch14", device="cuda"):
+    def __init__(self, model_name="openai/clip-vit-large-patch14", device="cuda", text_padding="max_length",
+                 text_only=False):
         super().__init__()
         self.model_name, self.device = model_name, device
-
-        from transformers import CLIPProcessor, CLIPModel
-        self.processor = CLIPProcessor.from_pretrained(model_name)          # default normalisation
-        self.model     = CLIPModel.from_pretrained(model_name).to(device).eval()
+        # "longest" is exact for CLIP: causal attention + EOS pooling never see trailing pads
+        if text_padding not in TEXT_PADDING_MODES:
+            raise ValueError(f"Unsupported text padding mode: {text_padding}")
+        self.text_padding = text_padding
+
+        self.text_only = text_only
+        if text_only:
+            from transformers import CLIPTokenizer
+            self.processor = CLIPTokenizer.from_pretrained(model_name)
+            self.model     = load_text_tower(model_name).to(device).eval()
+        else:
+            from transformers import CLIPProcessor, CLIPModel
+            self.processor = CLIPProcessor.from_pretrained(model_name)          # default normalisation
+            self.model     = CLIPModel.from_pretrained(model_name).to(device).eval()
         self._feature_dim = self.MODEL_HIDDEN_SIZES.get(model_name, 768)
         
         # Disable gradient computation for all parameters (performance)
@@ -57,7 +197,7 @@ class OpenAICLIPFeatureExtractor(BaseFeatureExtractor):
     def extract_image_features(self, images) -> torch.Tensor:
         """`images` = list[PIL]  (processor handles resize/crop/normalise)."""
         device_type = "cuda" if self.device.type == "cuda" else "cpu"
-        with torch.inference_mode(), torch.autocast(device_type=device_type):
+        with torch.inference_mode(), torch.autocast(device_type=device_type, enabled=self.autocast_enabled):
             inputs   = self.processor(images=images, return_tensors="pt")
             # Move to device with non_blocking for overlapped data transfer
             inputs   = {k: v.to(self.device, non_blocking=True) for k, v in inputs.items()}
@@ -66,12 +206,17 @@ class OpenAICLIPFeatureExtractor(BaseFeatureExtractor):
 
     def extract_text_features(self, texts: List[str]) -> torch.Tensor:
         device_type = "cuda" if self.device.type == "cuda" else "cpu"
-        with torch.inference_mode(), torch.autocast(device_type=device_type):
+        with torch.inference_mode(), torch.autocast(device_type=device_type, enabled=self.autocast_enabled):
+            if self.text_padding == "longest":
+                tokenizer = getattr(self.processor, "tokenizer", self.processor)
+                embeds = _encode_text_length_bucketed(tokenizer, self._text_tower(), texts, self.device,
+                                                      tokenizer.model_max_length)
+                return F.normalize(embeds, dim=-1)
             inputs = self.processor(text=texts, return_tensors="pt",
                                     padding="max_length", truncation=True)
             # Move to device with non_blocking for overlapped data transfer
             inputs = {k: v.to(self.device, non_blocking=True) for k, v in inputs.items()}
-            embeds = self.model.get_text_features(**inputs)
+            embeds = self._text_tower().get_text_features(**inputs)
             return F.normalize(embeds, dim=-1)
 
     # ------------------------------------------------------------------ #
@@ -115,13 +260,13 @@ class OpenCLIPFeatureExtractor(BaseFeatureExtractor):
 
     def extract_image_features(self, images) -> torch.Tensor:
         device_type = "cuda" if self.device.type == "cuda" else "cpu"
-        with torch.inference_mode(), torch.autocast(device_type=device_type):
+        with torch.inference_mode(), torch.autocast(device_type=device_type, enabled=self.autocast_enabled):
             embeds = self.model.encode_image(self._preprocess_batch(images))
             return F.normalize(embeds, dim=-1)
 
     def extract_text_features(self, texts: List[str]) -> torch.Tensor:
         device_type = "cuda" if self.device.type == "cuda" else "cpu"
-        with torch.inference_mode(), torch.autocast(device_type=device_type):
+        with torch.inference_mode(), torch.autocast(device_type=device_type, enabled=self.autocast_enabled):
             tokens = self.tokenizer(texts).to(self.device, non_blocking=True)
             embeds = self.model.encode_text(tokens)
             return F.normalize(embeds, dim=-1)
@@ -142,24 +287,41 @@ def _parse_siglip_resolution(model_name: str, default: int = 224) -> int:
 
 
 class _SigLIPBase(BaseFeatureExtractor):
-    def _init_common(self, model_name, device):
+    def _init_common(self, model_name, device, text_padding="max_length", text_only=False):
         from transformers import AutoProcessor, AutoModel
         self.model_name, self.device = model_name, device
         
-        # Use AutoModel for SigLIP2 models to avoid class mismatch issues
-        self.model = AutoModel.from_pretrained(model_name, trust_remote_code=True).to(device).eval()
+        # The SigLIP text tower takes no attention mask and pools the last
+        # position, so padding is part of the embedding: only max_length matches
+        # the index (see util/test_siglip/test_text_padding.py)
+        if text_padding != "max_length":
+            raise ValueError(f"{type(self).__name__} only supports max_length text padding, got: {text_padding}")
+        self.text_padding = text_padding
+        
+        # Optional TextEmbeddingCache (see util/embedding_cache.py); set by the caller
+        self.text_cache = None
         
-        # Try to get processor, fallback to model's processor if available
-        try:
-            self.processor = AutoProcessor.from_pretrained(model_name, use_fast=False)
-        except ValueError:
-            # If processor fails, try to get it from the model's config
-            if hasattr(self.model, 'processor'):
-                self.processor = self.model.processor
-            else:
-                # Create a basic processor for text-only processing
-                from transformers import AutoTokenizer
-                self.processor = AutoTokenizer.from_pretrained(model_name)
+        self.text_only = text_only
+        if text_only:
+            # Text tower + tokenizer only: no vision weights, no image processor
+            from transformers import AutoTokenizer
+            self.model = load_text_tower(model_name).to(device).eval()
+            self.processor = AutoTokenizer.from_pretrained(model_name)
+        else:
+            # Use AutoModel for SigLIP2 models to avoid class mismatch issues
+            self.model = AutoModel.from_pretrained(model_name, trust_remote_code=True).to(device).eval()
+            
+            # Try to get processor, fallback to model's processor if available
+            try:
+                self.processor = AutoProcessor.from_pretrained(model_name, use_fast=False)
+            except ValueError:
+                # If processor fails, try to get it from the model's config
+                if hasattr(self.model, 'processor'):
+                    self.processor = self.model.processor
+                else:
+                    # Create a basic processor for text-only processing
+                    from transformers import AutoTokenizer
+                    self.processor = AutoTokenizer.from_pretrained(model_name)
         
         self._feature_dim = self.MODEL_HIDDEN_SIZES.get(model_name, 768)
         
@@ -181,7 +343,7 @@ class _SigLIPBase(BaseFeatureExtractor):
     # same implementation for image / text across SigLIP flavours
     def extract_image_features(self, images) -> torch.Tensor:
         device_type = "cuda" if self.device.type == "cuda" else "cpu"
-        with torch.inference_mode(), torch.autocast(device_type=device_type):
+        with torch.inference_mode(), torch.autocast(device_type=device_type, enabled=self.autocast_enabled):
             inputs  = self.processor(images=images, return_tensors="pt")
             # Move to device with non_blocking for overlapped data transfer
             inputs  = {k: v.to(self.device, non_blocking=True) for k, v in inputs.items()}
@@ -190,13 +352,25 @@ class _SigLIPBase(BaseFeatureExtractor):
 
     def extract_text_features(self, texts: List[str]) -> torch.Tensor:
         texts = [text.lower() for text in texts]
+        if self.text_cache is not None:
+            cache_name = self.model_name
+            if self.inference_backend != "eager":
+                cache_name = f"{self.model_name}|{self.text_padding}|{self.inference_backend}"
+            embeds = self.text_cache.get_or_encode(
+                cache_name, texts,
+                lambda batch: self._encode_text_batch(batch).cpu().float().numpy(),
+            )
+            return torch.from_numpy(embeds).to(self.device)
+        return self._encode_text_batch(texts)
+
+    def _encode_text_batch(self, texts: List[str]) -> torch.Tensor:
         device_type = "cuda" if self.device.type == "cuda" else "cpu"
-        with torch.inference_mode(), torch.autocast(device_type=device_type):
+        with torch.inference_mode(), torch.autocast(device_type=device_type, enabled=self.autocast_enabled):
             inputs = self.processor(text=texts, return_tensors="pt",
                                     padding="max_length", truncation=True, max_length=self._max_text_length)
             # Move to device with non_blocking for overlapped data transfer
             inputs = {k: v.to(self.device, non_blocking=True) for k, v in inputs.items()}
-            embeds = self.model.get_text_features(**inputs)
+            embeds = self._text_tower().get_text_features(**inputs)
             return F.normalize(embeds, dim=-1)
 
     @property
@@ -219,9 +393,10 @@ class SigLIPFeatureExtractor(_SigLIPBase):
         "google/siglip-giant-opt-patch16-384": 1280,
     }
 
-    def __init__(self, model_name="google/siglip-base-patch16-224", device="cuda"):
+    def __init__(self, model_name="google/siglip-base-patch16-224", device="cuda", text_padding="max_length",
+                 text_only=False):
         super().__init__()
-        self._init_common(model_name, device)
+        self._init_common(model_name, device, text_padding, text_only)
 
 
 class SigLIP2FeatureExtractor(_SigLIPBase):
@@ -245,9 +420,98 @@ class SigLIP2FeatureExtractor(_SigLIPBase):
         "google/siglip2-giant-opt-patch16-384": 1280,
     }
 
-    def __init__(self, model_name="google/siglip2-base-patch16-224", device="cuda"):
+    def __init__(self, model_name="google/siglip2-base-patch16-224", device="cuda", text_padding="max_length",
+                 text_only=False):
+        super().__init__()
+        self._init_common(model_name, device, text_padding, text_only)
+
+
+# --------------------------------------------------------------------------- #
+# CPU inference backends: eager torch, dynamic int8, ONNX Runtime text tower
+# --------------------------------------------------------------------------- #
+INFERENCE_BACKENDS = ("eager", "int8", "onnx")
+ONNX_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'models', 'onnx')
+
+
+class _TextTowerForExport(nn.Module):
+    """Wraps `model.get_text_features` so torch.onnx.export sees a plain forward()."""
+
+    def __init__(self, model, input_names):
         super().__init__()
-        self._init_common(model_name, device)
+        self.model, self.input_names = model, input_names
+
+    def forward(self, *args):
+        return self.model.get_text_features(**dict(zip(self.input_names, args)))
+
+
+class OnnxTextTower:
+    """ONNX Runtime session exposing the same `get_text_features(**inputs)` call as the HF model."""
+
+    def __init__(self, onnx_path: str, num_threads: int = 0):
+        import onnxruntime as ort
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = num_threads or torch.get_num_threads()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(onnx_path, options, providers=["CPUExecutionProvider"])
+        self.input_names = [i.name for i in self.session.get_inputs()]
+
+    def get_text_features(self, **inputs) -> torch.Tensor:
+        feeds = {name: inputs[name].cpu().numpy().astype(np.int64) for name in self.input_names}
+        return torch.from_numpy(self.session.run(None, feeds)[0])
+
+
+def export_text_tower_onnx(extractor: BaseFeatureExtractor, onnx_path: str) -> str:
+    """Export an HF extractor's text tower to ONNX (dynamic batch and sequence axes)."""
+    tokenizer = getattr(extractor.processor, "tokenizer", extractor.processor)
+    sample = tokenizer(["a street view photo"], return_tensors="pt", padding="max_length",
+                       truncation=True, max_length=getattr(extractor, "_max_text_length", None))
+    input_names = [name for name in ("input_ids", "attention_mask") if name in sample]
+    wrapper = _TextTowerForExport(extractor.model, input_names).eval()
+
+    os.makedirs(os.path.dirname(os.path.abspath(onnx_path)), exist_ok=True)
+    with torch.no_grad():
+        torch.onnx.export(
+            wrapper, tuple(sample[name] for name in input_names), onnx_path,
+            input_names=input_names, output_names=["text_embeds"],
+            dynamic_axes={**{name: {0: "batch", 1: "sequence"} for name in input_names},
+                          "text_embeds": {0: "batch"}},
+            opset_version=17,
+        )
+    return onnx_path
+
+
+def apply_inference_backend(extractor: BaseFeatureExtractor, backend: str) -> BaseFeatureExtractor:
+    """
+    Switch an extractor to a CPU inference backend.
+
+    - "eager": unchanged fp32 torch model (with autocast, as before)
+    - "int8":  torch dynamic quantisation of every nn.Linear (weights int8, activations fp32)
+    - "onnx":  text tower served by ONNX Runtime; exported once to models/onnx/ and reused
+    """
+    if backend not in INFERENCE_BACKENDS:
+        raise ValueError(f"Unsupported inference backend: {backend}")
+    if backend == "eager":
+        return extractor
+    if torch.device(extractor.device).type != "cpu":
+        raise ValueError(f"Inference backend '{backend}' is CPU only")
+
+    # Quantised / ONNX kernels expect fp32 activations, so autocast must stay off
+    extractor.autocast_enabled = False
+    extractor.inference_backend = backend
+
+    if backend == "int8":
+        extractor.model = torch.ao.quantization.quantize_dynamic(
+            extractor.model, {nn.Linear}, dtype=torch.qint8
+        )
+    elif backend == "onnx":
+        if not hasattr(extractor, "processor"):
+            raise ValueError(f"ONNX backend is not supported for {type(extractor).__name__}")
+        onnx_path = os.path.join(ONNX_CACHE_DIR, extractor.model_name.replace("/", "__") + ".text.onnx")
+        if not os.path.exists(onnx_path):
+            print(f"Exporting text tower of {extractor.model_name} to {onnx_path}")
+            export_text_tower_onnx(extractor, onnx_path)
+        extractor._onnx_text_tower = OnnxTextTower(onnx_path)
+    return extractor
 
 
 # --------------------------------------------------------------------------- #
@@ -257,14 +521,25 @@ class FeatureExtractorFactory:
     """Create an extractor given its model‑checkpoint string."""
 
     @staticmethod
-    def create_extractor(model_name: str, device: str = "cuda") -> BaseFeatureExtractor:
+    def create_extractor(model_name: str, device: str = "cuda", text_padding: str = "max_length",
+                         backend: str = "eager", text_only: bool = False) -> BaseFeatureExtractor:
+        """
+        `text_padding`: "max_length" (reference behaviour) or, for OpenAI CLIP
+        only, "longest" (pad each length bucket only to its longest prompt).
+        SigLIP / SigLIP2 reject "longest"; OpenCLIP ignores it.
+        `backend`: "eager", "int8" or "onnx" (see `apply_inference_backend`).
+        `text_only`: load only the text tower and tokenizer (see `load_text_tower`);
+        `extract_image_features` is then unavailable. OpenCLIP ignores it.
+        """
         lower = model_name.lower()
         if "openai/clip" in lower:
-            return OpenAICLIPFeatureExtractor(model_name, device)
-        if "siglip2" in lower:
-            return SigLIP2FeatureExtractor(model_name, device)
-        if "siglip" in lower:
-            return SigLIPFeatureExtractor(model_name, device)
-        if lower.startswith(("vit-b", "vit-l", "vit-h")) or "vit-" in lower:
-            return OpenCLIPFeatureExtractor(model_name, device)
-        raise ValueError(f"Unsupported extractor type: {model_name}")
+            extractor = OpenAICLIPFeatureExtractor(model_name, device, text_padding, text_only)
+        elif "siglip2" in lower:
+            extractor = SigLIP2FeatureExtractor(model_name, device, text_padding, text_only)
+        elif "siglip" in lower:
+            extractor = SigLIPFeatureExtractor(model_name, device, text_padding, text_only)
+        elif lower.startswith(("vit-b", "vit-l", "vit-h")) or "vit-" in lower:
+            extractor = OpenCLIPFeatureExtractor(model_name, device)
+        else:
+            raise ValueError(f"Unsupported extractor type: {model_name}")
+        return apply_inference_backend(extractor, backend)
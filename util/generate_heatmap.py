@@ -7,6 +7,7 @@ sys.path.append(os.path.join(os.getcwd(), '..', 'creds'))
 import creds
 
 from pymilvus import MilvusClient
+from vector_index import coordinates_from_ids
 
 
 def softmax(x, temperature=1.0):
@@ -35,29 +36,16 @@ def retrieve_embeddings():
         limit=10,
         offset=0
     )
-    
-    lats, longs, distances = [], [], []
-    for result in res[0]:
-        lat, long = result['id'].split('_')
-        
 
-     
     return res
 
 def generate_heatmap():
     print(encoded_prompt.size())
     dataset_embeddings = retrieve_embeddings()
 
-    lats, longs, embeds = [], [], []
-
-    for file in dataset_embeddings:
-        lat, long = file.split('_')
-        lat = float(lat)
-        long = float(long)
-
-        lats.append(lat)
-        longs.append(long)
-        embeds.append(dataset_embeddings[file])
+    ids = list(dataset_embeddings)
+    lats, longs = coordinates_from_ids(ids)
+    embeds = [dataset_embeddings[file] for file in ids]
 
     df = pd.DataFrame(data = {
         'lats' : lats,
@@ -0,0 +1,212 @@
+import json
+import os
+import threading
+from abc import ABC, abstractmethod
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+EARTH_RADIUS_M = 6371008.8
+
+# (min_lat, min_lng, max_lat, max_lng)
+BBox = Tuple[float, float, float, float]
+
+
+# --------------------------------------------------------------------------- #
+# Regions
+# --------------------------------------------------------------------------- #
+class GeoRegion(ABC):
+    """
+    Area a search is restricted to.
+
+    `bbox` is a conservative bounding box used for prefiltering (vector-store
+    scalar filters, spatial grid cells); `contains` is the exact vectorised test.
+    """
+
+    @abstractmethod
+    def bbox(self) -> BBox: ...
+
+    @abstractmethod
+    def contains(self, lat: np.ndarray, lng: np.ndarray) -> np.ndarray: ...
+
+    def key(self) -> str:
+        """Stable identity of the region, for caches keyed by area."""
+        return repr(self)
+
+    def milvus_expr(self) -> str:
+        """Scalar prefilter on numeric `lat`/`lng` fields (bounding box)."""
+        # Plain floats: under NumPy 2 a numpy scalar reprs as np.float64(...)
+        min_lat, min_lng, max_lat, max_lng = (float(v) for v in self.bbox())
+        return (f"lat >= {min_lat!r} and lat <= {max_lat!r} and "
+                f"lng >= {min_lng!r} and lng <= {max_lng!r}")
+
+
+class BBoxRegion(GeoRegion):
+    def __init__(self, min_lat: float, min_lng: float, max_lat: float, max_lng: float):
+        if min_lat > max_lat or min_lng > max_lng:
+            raise ValueError(f"Invalid bounding box: {(min_lat, min_lng, max_lat, max_lng)}")
+        self.bounds = (float(min_lat), float(min_lng), float(max_lat), float(max_lng))
+
+    def bbox(self) -> BBox:
+        return self.bounds
+
+    def contains(self, lat, lng):
+        min_lat, min_lng, max_lat, max_lng = self.bounds
+        return (lat >= min_lat) & (lat <= max_lat) & (lng >= min_lng) & (lng <= max_lng)
+
+    def __repr__(self):
+        return f"BBoxRegion{self.bounds}"
+
+
+class CircleRegion(GeoRegion):
+    def __init__(self, lat: float, lng: float, radius_m: float):
+        if radius_m <= 0:
+            raise ValueError("radius_m must be positive")
+        self.lat, self.lng, self.radius_m = float(lat), float(lng), float(radius_m)
+
+    def bbox(self) -> BBox:
+        dlat = float(np.degrees(self.radius_m / EARTH_RADIUS_M))
+        dlng = dlat / max(float(np.cos(np.radians(self.lat))), 1e-6)
+        return (self.lat - dlat, self.lng - dlng, self.lat + dlat, self.lng + dlng)
+
+    def contains(self, lat, lng):
+        return haversine_m(self.lat, self.lng, lat, lng) <= self.radius_m
+
+    def __repr__(self):
+        return f"CircleRegion({self.lat}, {self.lng}, radius_m={self.radius_m})"
+
+
+class PolygonRegion(GeoRegion):
+    """Simple polygon of (lat, lng) vertices (no holes, not crossing the antimeridian)."""
+
+    def __init__(self, points: Sequence[Sequence[float]]):
+        pts = np.asarray(points, dtype=np.float64)
+        if pts.ndim != 2 or pts.shape[0] < 3 or pts.shape[1] != 2:
+            raise ValueError("polygon needs at least 3 (lat, lng) points")
+        self.points = pts
+
+    def bbox(self) -> BBox:
+        (min_lat, min_lng), (max_lat, max_lng) = self.points.min(axis=0), self.points.max(axis=0)
+        return (float(min_lat), float(min_lng), float(max_lat), float(max_lng))
+
+    def contains(self, lat, lng):
+        # Even-odd ray casting, vectorised over points; one pass per edge
+        lat, lng = np.asarray(lat, dtype=np.float64), np.asarray(lng, dtype=np.float64)
+        inside = np.zeros(lat.shape, dtype=bool)
+        y, x = self.points[:, 0], self.points[:, 1]
+        for i in range(len(self.points)):
+            j = i - 1
+            crosses = (y[i] > lat) != (y[j] > lat)
+            with np.errstate(divide="ignore", invalid="ignore"):
+                x_at = x[i] + (lat - y[i]) * (x[j] - x[i]) / (y[j] - y[i])
+            inside ^= crosses & (lng < x_at)
+        return inside
+
+    def __repr__(self):
+        return f"PolygonRegion({len(self.points)} points)"
+
+    def key(self) -> str:
+        return "polygon:" + ",".join(f"{lat!r}:{lng!r}" for lat, lng in self.points.tolist())
+
+
+def haversine_m(lat1, lng1, lat2, lng2):
+    lat1, lng1, lat2, lng2 = (np.radians(v) for v in (lat1, lng1, lat2, lng2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(a))
+
+
+def bbox_intersects(a: BBox, b: BBox) -> bool:
+    return a[0] <= b[2] and b[0] <= a[2] and a[1] <= b[3] and b[1] <= a[3]
+
+
+# --------------------------------------------------------------------------- #
+# City name -> bounding box
+# --------------------------------------------------------------------------- #
+class CityBoundsResolver:
+    """
+    Resolve a city name (as returned by /api/extract) to a bounding box.
+
+    Lookup order: the JSON file named by PLANIT_CITY_BOUNDS
+    ({"st. louis": [min_lat, min_lng, max_lat, max_lng], ...}), then the Google
+    Geocoding API viewport when an API key is available. Found bounds and
+    definitive misses (ZERO_RESULTS) are cached; transient geocoding errors
+    are not, so they are retried next time.
+    """
+
+    GEOCODE_URL = "https://maps.googleapis.com/maps/api/geocode/json"
+
+    def __init__(self, api_key: Optional[str] = None, bounds_path: Optional[str] = None):
+        self.api_key = api_key
+        self._lock = threading.Lock()
+        self._cache: Dict[str, Optional[BBox]] = {}
+        bounds_path = bounds_path or os.getenv("PLANIT_CITY_BOUNDS")
+        if bounds_path and os.path.exists(bounds_path):
+            with open(bounds_path) as f:
+                for name, bounds in json.load(f).items():
+                    self._cache[self._key(name)] = tuple(float(v) for v in bounds)
+
+    @staticmethod
+    def _key(city: str) -> str:
+        return " ".join(city.lower().split())
+
+    def resolve(self, city: str) -> Optional[BBox]:
+        key = self._key(city)
+        with self._lock:
+            if key in self._cache:
+                return self._cache[key]
+        bounds, definitive = self._geocode(city)
+        if definitive:
+            with self._lock:
+                self._cache[key] = bounds
+        return bounds
+
+    def _geocode(self, city: str) -> Tuple[Optional[BBox], bool]:
+        """(bounds or None, whether the answer may be cached)"""
+        if not self.api_key:
+            return None, False
+        import requests
+        try:
+            resp = requests.get(self.GEOCODE_URL, params={"address": city, "key": self.api_key}, timeout=10)
+            body = resp.json()
+        except Exception as e:
+            print(f"⚠️  Geocoding '{city}' failed: {e}")
+            return None, False
+        status = body.get("status")
+        if status == "ZERO_RESULTS":
+            return None, True
+        results = body.get("results") or []
+        if status != "OK" or not results:
+            # OVER_QUERY_LIMIT, REQUEST_DENIED, UNKNOWN_ERROR, ...: try again next time
+            print(f"⚠️  Geocoding '{city}' failed: {status} {body.get('error_message', '')}")
+            return None, False
+        viewport = results[0]["geometry"].get("bounds") or results[0]["geometry"]["viewport"]
+        sw, ne = viewport["southwest"], viewport["northeast"]
+        return (float(sw["lat"]), float(sw["lng"]), float(ne["lat"]), float(ne["lng"])), True
+
+
+def build_region(bbox: Optional[List[float]] = None, center: Optional[List[float]] = None,
+                 radius_m: Optional[float] = None, polygon: Optional[List[List[float]]] = None,
+                 city: Optional[str] = None,
+                 city_resolver: Optional[CityBoundsResolver] = None) -> Optional[GeoRegion]:
+    """
+    Region from request parameters, most specific first: polygon, center +
+    radius, bbox, then city. Returns None when the search is unbounded
+    (including an unknown city).
+    """
+    if polygon:
+        return PolygonRegion(polygon)
+    if center is not None and radius_m:
+        if len(center) != 2:
+            raise ValueError("center must be [lat, lng]")
+        return CircleRegion(center[0], center[1], radius_m)
+    if bbox:
+        if len(bbox) != 4:
+            raise ValueError("bbox must be [min_lat, min_lng, max_lat, max_lng]")
+        return BBoxRegion(*bbox)
+    if city and city_resolver is not None:
+        bounds = city_resolver.resolve(city)
+        if bounds is None:
+            print(f"⚠️  Unknown city '{city}', searching without a geo bound")
+            return None
+        return BBoxRegion(*bounds)
+    return None
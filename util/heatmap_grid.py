@@ -0,0 +1,144 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional
+
+import numpy as np
+
+# Web-mercator tiles are 256 px wide; one grid cell covers CELL_PX screen pixels
+TILE_PX = 256
+CELL_PX = 16
+
+# Deepest web-map zoom; beyond it global cell ids (rows * n_cols) lose float64 precision
+MAX_ZOOM = 22
+
+CELL_AGGREGATIONS = ("mean", "max", "sum")
+LAYER_COMBINATIONS = ("mean", "sum", "max")
+
+
+def cell_size_deg(zoom: int, cell_px: int = CELL_PX) -> float:
+    """Grid cell edge in degrees so one cell spans about `cell_px` pixels at `zoom`."""
+    return 360.0 / (TILE_PX * (1 << int(zoom))) * cell_px
+
+
+def cell_ids(lat: np.ndarray, lng: np.ndarray, cell_deg: float) -> np.ndarray:
+    """Global integer id of the regular lat/lng raster cell of each point (-1 if unknown)."""
+    n_cols = int(np.ceil(360.0 / cell_deg))
+    rows = np.floor((np.asarray(lat) + 90.0) / cell_deg)
+    cols = np.floor((np.asarray(lng) + 180.0) / cell_deg)
+    ids = rows * n_cols + np.clip(cols, 0, n_cols - 1)
+    return np.where(np.isfinite(ids), ids, -1).astype(np.int64)
+
+
+def cell_centers(ids: np.ndarray, cell_deg: float):
+    n_cols = int(np.ceil(360.0 / cell_deg))
+    rows, cols = np.divmod(ids, n_cols)
+    return (rows + 0.5) * cell_deg - 90.0, (cols + 0.5) * cell_deg - 180.0
+
+
+def bin_scores(ids: np.ndarray, weights: np.ndarray, cells: np.ndarray, how: str = "mean") -> np.ndarray:
+    """
+    Aggregate per-point `weights` onto the sorted cell id array `cells`
+    (every id must be in `cells`). Returns one value per cell.
+    """
+    idx = np.searchsorted(cells, ids)
+    if how == "max":
+        out = np.full(len(cells), -np.inf)
+        np.maximum.at(out, idx, weights)
+        return np.where(np.isfinite(out), out, 0.0)
+    sums = np.bincount(idx, weights=weights, minlength=len(cells))
+    if how == "sum":
+        return sums
+    counts = np.bincount(idx, minlength=len(cells))
+    return sums / np.maximum(counts, 1)
+
+
+def aggregate_layers(layers: Dict[str, tuple], zoom: int, cell_agg: str = "mean",
+                     combine: str = "mean", weights: Optional[Dict[str, float]] = None) -> dict:
+    """
+    Bin several amenity layers onto one grid and combine them per cell.
+
+    `layers` maps amenity -> (lat, lng, score) arrays; each layer keeps its own
+    coordinates, so layers from different hit lists line up by cell. Every
+    layer is scaled to [0, 1] before combining (`weights` scales them further).
+
+    Returns {"cell_deg", "lat", "lng", "weight", "layers": {amenity: per-cell}}
+    with one entry per non-empty cell.
+    """
+    if cell_agg not in CELL_AGGREGATIONS:
+        raise ValueError(f"Unsupported cell aggregation: {cell_agg}")
+    if combine not in LAYER_COMBINATIONS:
+        raise ValueError(f"Unsupported layer combination: {combine}")
+    if not 0 <= int(zoom) <= MAX_ZOOM:
+        raise ValueError(f"zoom must be between 0 and {MAX_ZOOM}")
+    cell_deg = cell_size_deg(zoom)
+
+    layer_ids = {}
+    for name, (lat, lng, score) in layers.items():
+        ids = cell_ids(lat, lng, cell_deg)
+        valid = ids >= 0
+        layer_ids[name] = (ids[valid], np.asarray(score, dtype=np.float64)[valid])
+
+    cells = np.unique(np.concatenate([ids for ids, _ in layer_ids.values()])) if layer_ids else np.empty(0, np.int64)
+    per_layer = {}
+    for name, (ids, score) in layer_ids.items():
+        grid = bin_scores(ids, score, cells, cell_agg)
+        peak = grid.max() if grid.size else 0.0
+        per_layer[name] = grid / peak if peak > 0 else grid
+        if weights and name in weights:
+            per_layer[name] = per_layer[name] * float(weights[name])
+
+    if per_layer:
+        stacked = np.vstack(list(per_layer.values()))
+        combined = {"mean": stacked.mean, "sum": stacked.sum, "max": stacked.max}[combine](axis=0)
+    else:
+        combined = np.empty(0)
+    lat, lng = cell_centers(cells, cell_deg)
+    return {"cell_deg": cell_deg, "lat": lat, "lng": lng, "weight": combined, "layers": per_layer}
+
+
+class GridCache:
+    """
+    Bounded, thread-safe LRU of aggregated grids keyed by query + zoom.
+
+    Entries expire after `ttl_seconds` (None: never), so grids computed before
+    an index refresh stop being served once the refresh is older than the TTL.
+    """
+
+    def __init__(self, max_entries: int = 256, ttl_seconds: Optional[float] = 600.0):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._grids: "OrderedDict[str, tuple]" = OrderedDict()  # key -> (expires_at, grid)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str) -> Optional[dict]:
+        with self._lock:
+            entry = self._grids.get(key)
+            if entry is not None and entry[0] < time.monotonic():
+                del self._grids[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._grids.move_to_end(key)
+            return entry[1]
+
+    def put(self, key: str, grid: dict):
+        expires_at = time.monotonic() + self.ttl_seconds if self.ttl_seconds else float("inf")
+        with self._lock:
+            self._grids[key] = (expires_at, grid)
+            self._grids.move_to_end(key)
+            while len(self._grids) > self.max_entries:
+                self._grids.popitem(last=False)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"entries": len(self._grids), "hits": self.hits, "misses": self.misses,
+                    "ttl_seconds": self.ttl_seconds}
+
+    def clear(self):
+        with self._lock:
+            self._grids.clear()
@@ -0,0 +1,192 @@
+import queue
+import threading
+import time
+from concurrent.futures import Executor, Future
+from typing import Callable, List, Optional
+
+
+class _Request:
+    __slots__ = ("texts", "future", "enqueued_at")
+
+    def __init__(self, texts: List[str]):
+        self.texts = texts
+        self.future: Future = Future()
+        self.enqueued_at = time.perf_counter()
+
+
+class TextMicroBatcher:
+    """
+    Coalesce concurrent text-embedding calls into shared forward passes.
+
+    Callers `submit()` a list of texts and get a Future. A single collector
+    thread gathers requests for up to `max_wait_ms` or `max_batch_size` texts,
+    runs `encode_fn` once on the concatenation and fans the rows back out.
+
+    With an `executor` (e.g. the server's bounded encoder pool) each batch runs
+    there instead of on the collector thread, at most `max_in_flight` at once;
+    while they are all busy, new requests keep coalescing into the next batch.
+
+    `encode_fn` takes a list of texts and returns an array/tensor whose first
+    dimension matches the number of texts.
+    """
+
+    def __init__(self, encode_fn: Callable[[List[str]], object], max_batch_size: int = 16,
+                 max_wait_ms: float = 5.0, name: str = "text-micro-batcher",
+                 executor: Optional[Executor] = None, max_in_flight: int = 1):
+        self.encode_fn = encode_fn
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0.0, max_wait_ms) / 1000.0
+        self.executor = executor
+        self.max_in_flight = max(1, max_in_flight)
+        self._slots = threading.Semaphore(self.max_in_flight)
+
+        self._queue: "queue.Queue[Optional[_Request]]" = queue.Queue()
+        self._carry: Optional[_Request] = None
+        self._lock = threading.Lock()
+
+        # Metrics
+        self._queued_items = 0
+        self.max_queue_depth = 0
+        self.batches = 0
+        self.batched_items = 0
+        self._wait_seconds = 0.0
+        self._encode_seconds = 0.0
+
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    # ------------------------------------------------------------------ #
+    # Public API
+    # ------------------------------------------------------------------ #
+    def submit(self, texts: List[str]) -> Future:
+        """Queue `texts` for encoding; the Future resolves to their rows."""
+        request = _Request(list(texts))
+        if not request.texts:
+            request.future.set_result(self.encode_fn([]))
+            return request.future
+        with self._lock:
+            self._queued_items += len(request.texts)
+            self.max_queue_depth = max(self.max_queue_depth, self._queued_items)
+        self._queue.put(request)
+        return request.future
+
+    def encode(self, texts: List[str]):
+        """Blocking convenience wrapper around `submit()`."""
+        return self.submit(texts).result()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "queue_depth": self._queued_items,
+                "max_queue_depth": self.max_queue_depth,
+                "batches": self.batches,
+                "batched_items": self.batched_items,
+                "avg_batch_size": self.batched_items / self.batches if self.batches else 0.0,
+                "avg_queue_wait_ms": 1000.0 * self._wait_seconds / self.batched_items if self.batched_items else 0.0,
+                "avg_encode_ms": 1000.0 * self._encode_seconds / self.batches if self.batches else 0.0,
+                "max_batch_size": self.max_batch_size,
+                "max_in_flight": self.max_in_flight,
+                "max_wait_ms": self.max_wait * 1000.0,
+            }
+
+    def close(self):
+        """Stop the worker after the requests already queued have been served."""
+        self._queue.put(None)
+        self._thread.join()
+        # Wait for batches still running on the executor
+        for _ in range(self.max_in_flight):
+            self._slots.acquire()
+
+    # ------------------------------------------------------------------ #
+    # Worker
+    # ------------------------------------------------------------------ #
+    def _collect(self) -> List[Optional[_Request]]:
+        """Block for the first request, then gather more until full or timed out."""
+        first = self._carry if self._carry is not None else self._queue.get()
+        self._carry = None
+        if first is None:
+            return [None]
+
+        batch = [first]
+        size = len(first.texts)
+        deadline = time.perf_counter() + self.max_wait
+        while size < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                request = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if request is None:
+                batch.append(None)
+                break
+            if size + len(request.texts) > self.max_batch_size:
+                # Doesn't fit: it opens the next batch instead
+                self._carry = request
+                break
+            batch.append(request)
+            size += len(request.texts)
+        return batch
+
+    def _run(self):
+        while True:
+            # Only start collecting once a batch can run; until then the queue fills up
+            self._slots.acquire()
+            batch = self._collect()
+            stop = batch[-1] is None
+            requests = [r for r in batch if r is not None]
+            if requests:
+                self._dispatch(requests)
+            else:
+                self._slots.release()
+            if stop:
+                return
+
+    def _dispatch(self, requests: List[_Request]):
+        """Run one batch inline or on the executor; releases its slot when done."""
+        started = time.perf_counter()
+        with self._lock:
+            self._queued_items -= sum(len(r.texts) for r in requests)
+
+        # Drop requests whose caller already gave up (e.g. a cancelled HTTP request)
+        requests = [r for r in requests if r.future.set_running_or_notify_cancel()]
+        if not requests:
+            self._slots.release()
+            return
+        if self.executor is None:
+            self._run_batch(requests, started)
+            return
+        try:
+            self.executor.submit(self._run_batch, requests, started)
+        except RuntimeError as e:  # executor already shut down
+            for r in requests:
+                r.future.set_exception(e)
+            self._slots.release()
+
+    def _run_batch(self, requests: List[_Request], started: float):
+        try:
+            self._encode_batch(requests, started)
+        finally:
+            self._slots.release()
+
+    def _encode_batch(self, requests: List[_Request], started: float):
+        texts = [text for r in requests for text in r.texts]
+        with self._lock:
+            self._wait_seconds += sum((started - r.enqueued_at) * len(r.texts) for r in requests)
+
+        try:
+            embeds = self.encode_fn(texts)
+        except Exception as e:
+            for r in requests:
+                r.future.set_exception(e)
+            return
+        elapsed = time.perf_counter() - started
+
+        offset = 0
+        for r in requests:
+            r.future.set_result(embeds[offset:offset + len(r.texts)])
+            offset += len(r.texts)
+
+        with self._lock:
+            self.batches += 1
+            self.batched_items += len(texts)
+            self._encode_seconds += elapsed
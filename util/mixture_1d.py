@@ -0,0 +1,137 @@
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+import numpy as np
+
+# (weights, means, variances), each of shape (n_components,)
+MixtureParams = Tuple[np.ndarray, np.ndarray, np.ndarray]
+
+_LOG_2PI = np.log(2.0 * np.pi)
+
+
+def _kmeans_1d(x_sorted: np.ndarray, centers: np.ndarray, max_iter: int = 100) -> Tuple[np.ndarray, float]:
+    """
+    Lloyd's k-means on sorted scalar data. In 1-D every cluster is a
+    contiguous run of the sorted samples, so an iteration is a searchsorted on
+    the midpoints plus prefix sums. Returns (run boundaries, inertia).
+    """
+    csum = np.concatenate([[0.0], np.cumsum(x_sorted)])
+    csum2 = np.concatenate([[0.0], np.cumsum(x_sorted * x_sorted)])
+    n = x_sorted.shape[0]
+    bounds = None
+    for _ in range(max_iter):
+        centers = np.sort(centers)
+        new_bounds = np.concatenate([[0], np.searchsorted(x_sorted, (centers[:-1] + centers[1:]) / 2), [n]])
+        if bounds is not None and np.array_equal(new_bounds, bounds):
+            break
+        bounds = new_bounds
+        counts = np.diff(bounds)
+        sums = np.diff(csum[bounds])
+        # An empty cluster keeps its center
+        centers = np.where(counts > 0, sums / np.maximum(counts, 1), centers)
+    counts = np.diff(bounds)
+    sums, sums2 = np.diff(csum[bounds]), np.diff(csum2[bounds])
+    inertia = float((sums2 - sums * sums / np.maximum(counts, 1)).sum())
+    return bounds, inertia
+
+
+def _kmeans_init(x: np.ndarray, n_components: int, reg_covar: float) -> MixtureParams:
+    """
+    Deterministic initialisation from a hard 1-D k-means partition, as sklearn's
+    default init_params="kmeans" does. Lloyd's is run from centers at evenly
+    spaced quantiles and from centers evenly spaced over the range, and the
+    partition with the lower inertia is kept: quantile seeds alone put every
+    center in the bulk of skewed data and merge a small top cluster into it.
+    """
+    x_sorted = np.sort(x)
+    qs = (np.arange(n_components) + 0.5) / n_components
+    seeds = (np.quantile(x_sorted, qs), x_sorted[0] + qs * (x_sorted[-1] - x_sorted[0]))
+    bounds, _ = min((_kmeans_1d(x_sorted, c) for c in seeds), key=lambda fit: fit[1])
+
+    weights, means, variances = (np.empty(n_components) for _ in range(3))
+    for k, (lo, hi) in enumerate(zip(bounds[:-1], bounds[1:])):
+        cluster = x_sorted[lo:hi] if hi > lo else x_sorted
+        weights[k] = max(hi - lo, 1) / x.shape[0]
+        means[k] = cluster.mean()
+        variances[k] = cluster.var() + reg_covar
+    return weights / weights.sum(), means, variances
+
+
+def fit_gmm_1d(x: np.ndarray, n_components: int = 3, max_iter: int = 100, tol: float = 1e-3,
+               reg_covar: float = 1e-6) -> MixtureParams:
+    """
+    Fit a Gaussian mixture to scalar data with EM.
+
+    Equivalent to sklearn's GaussianMixture(covariance_type="full") on (n, 1)
+    data, but works on flat arrays and is fully deterministic: the result only
+    depends on `x` and the arguments.
+
+    Args:
+        x: 1-D array of samples
+        n_components: Number of mixture components
+        max_iter: Maximum number of EM iterations
+        tol: Stop once the mean log-likelihood improves by less than this
+        reg_covar: Added to every variance to keep components non-degenerate
+
+    Returns:
+        (weights, means, variances)
+    """
+    x = np.asarray(x, dtype=np.float64).ravel()
+    weights, means, variances = _kmeans_init(x, n_components, reg_covar)
+
+    eps = 10 * np.finfo(np.float64).eps
+    prev_ll = -np.inf
+    for _ in range(max_iter):
+        # E-step: log responsibilities, shape (n, k)
+        diff = x[:, None] - means[None, :]
+        log_prob = (np.log(weights + eps) - 0.5 * (_LOG_2PI + np.log(variances))
+                    - 0.5 * diff * diff / variances)
+        log_norm = np.logaddexp.reduce(log_prob, axis=1)
+        resp = np.exp(log_prob - log_norm[:, None])
+
+        # M-step
+        nk = resp.sum(axis=0) + eps
+        weights = nk / x.shape[0]
+        means = (resp.T @ x) / nk
+        diff = x[:, None] - means[None, :]
+        variances = (resp * diff * diff).sum(axis=0) / nk + reg_covar
+
+        ll = log_norm.mean()
+        if abs(ll - prev_ll) < tol:
+            break
+        prev_ll = ll
+
+    return weights, means, variances
+
+
+class MixtureFitCache:
+    """
+    Bounded, thread-safe memo of mixture fits keyed by a fingerprint of the
+    fitted data (see `fingerprint`), so identical score vectors are fitted once.
+    """
+
+    def __init__(self, max_entries: int = 1024):
+        self.max_entries = max_entries
+        self._fits: "OrderedDict[str, MixtureParams]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def fingerprint(x: np.ndarray, n_components: int) -> str:
+        x = np.ascontiguousarray(x, dtype=np.float64)
+        return f"{n_components}:{hashlib.blake2b(x.tobytes(), digest_size=16).hexdigest()}"
+
+    def get(self, key: str) -> Optional[MixtureParams]:
+        with self._lock:
+            params = self._fits.get(key)
+            if params is not None:
+                self._fits.move_to_end(key)
+            return params
+
+    def put(self, key: str, params: MixtureParams):
+        with self._lock:
+            self._fits[key] = params
+            self._fits.move_to_end(key)
+            while len(self._fits) > self.max_entries:
+                self._fits.popitem(last=False)
@@ -0,0 +1,103 @@
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+FUSION_MODES = ("product", "weighted_sum", "min")
+
+
+def filter_weights(keys: Sequence[str], filters: Optional[dict]) -> np.ndarray:
+    """
+    Per-amenity weights from the request filters (e.g. {"school": 5, "park": 3}),
+    normalised to sum to 1. Non-numeric or missing values count as 1.
+    """
+    values = []
+    for key in keys:
+        try:
+            value = float((filters or {}).get(key, 1.0))
+        except (TypeError, ValueError):
+            value = 1.0
+        values.append(max(value, 0.0))
+    weights = np.asarray(values, dtype=np.float64)
+    total = weights.sum()
+    return weights / total if total > 0 else np.full(len(keys), 1.0 / max(len(keys), 1))
+
+
+def align_layers(id_lists: Sequence[np.ndarray], score_lists: Sequence[np.ndarray],
+                 missing: float = 0.0):
+    """
+    Join several (ids, scores) hit lists on location id.
+
+    Returns (ids, first_index, matrix): the sorted union of ids, for each the
+    (layer, position) it was first seen at, and an (n_ids, n_layers) score
+    matrix with `missing` where a location is absent from a layer.
+    """
+    ids = [np.asarray(i).astype(str) for i in id_lists]
+    all_ids = np.concatenate(ids) if ids else np.empty(0, dtype=str)
+    union, first = np.unique(all_ids, return_index=True)
+
+    matrix = np.full((len(union), len(ids)), missing, dtype=np.float64)
+    for k, (layer_ids, scores) in enumerate(zip(ids, score_lists)):
+        # union is sorted, so searchsorted is the row of each layer id
+        matrix[np.searchsorted(union, layer_ids), k] = np.asarray(scores, dtype=np.float64)
+    return union, first, matrix
+
+
+def fuse_scores(matrix: np.ndarray, weights: np.ndarray, mode: str = "weighted_sum") -> np.ndarray:
+    """
+    Combined suitability per row of an aligned (n_locations, n_amenities) matrix.
+
+    Columns are scaled to [0, 1] by their maximum first, then:
+      weighted_sum: sum_k w_k * s_k
+      product:      prod_k s_k ** w_k   (weighted geometric mean; 0 if any amenity is 0)
+      min:          min_k s_k           (every amenity must be good)
+
+    Amenities with weight 0 are ignored in every mode. `min` only uses the
+    weights for that: the magnitudes of non-zero weights do not matter there.
+    """
+    if mode not in FUSION_MODES:
+        raise ValueError(f"Unsupported fusion mode: {mode}")
+    if matrix.size == 0:
+        return np.zeros(matrix.shape[0])
+    peak = matrix.max(axis=0)
+    scaled = np.divide(matrix, peak, out=np.zeros_like(matrix), where=peak > 0)
+    active = weights > 0
+    if mode == "weighted_sum":
+        return scaled @ weights
+    if not active.any():
+        return np.zeros(matrix.shape[0])
+    if mode == "product":
+        # log(0) * 0 would be NaN, so zero-weight columns are dropped first
+        with np.errstate(divide="ignore"):
+            return np.exp(np.log(scaled[:, active]) @ weights[active])
+    return scaled[:, active].min(axis=1)
+
+
+def fuse_hits(keys: List[str], batched_hits: list, heatmap_scores: Dict[str, list],
+              filters: Optional[dict] = None, mode: str = "weighted_sum") -> dict:
+    """
+    Align every amenity's hits by location id and fuse their scores.
+
+    Returns columns sorted by descending combined score:
+        {"mode", "amenities", "weights", "id", "lat", "lng", "matrix", "score"}
+    where `matrix` is (n_locations, n_amenities), aligned with `amenities`.
+    """
+    ids, first, matrix = align_layers([hits.ids for hits in batched_hits],
+                                      [heatmap_scores[key] for key in keys])
+    weights = filter_weights(keys, filters)
+    combined = fuse_scores(matrix, weights, mode)
+
+    # Coordinates of each location, from wherever it was first seen
+    lat = np.concatenate([hits.lat for hits in batched_hits])[first]
+    lng = np.concatenate([hits.lng for hits in batched_hits])[first]
+
+    order = np.argsort(-combined, kind="stable")
+    return {
+        "mode": mode,
+        "amenities": list(keys),
+        "weights": weights,
+        "id": ids[order],
+        "lat": lat[order],
+        "lng": lng[order],
+        "matrix": matrix[order],
+        "score": combined[order],
+    }
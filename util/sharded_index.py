@@ -0,0 +1,306 @@
+"""
+Geohash-sharded local index: one LocalSearchBackend per geohash prefix.
+
+Layout under `root`:
+
+    shards.json                       {prefix: {"bbox": [...], "count": n, "bytes": b}}
+    {prefix}/index.embeddings.npy     (+ .ids.npy, .coords.npy, optional .ivf.npz)
+
+Build from an existing local index:
+
+    python util/sharded_index.py --index ./models/index/planit --out ./models/index/shards --precision 3
+"""
+import argparse
+import heapq
+import json
+import os
+import sys
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from itertools import count, islice, repeat
+from typing import Dict, List, Optional
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from geo import GeoRegion, bbox_intersects
+from vector_index import BaseSearchBackend, LocalSearchBackend, SearchHits, save_local_index
+
+GEOHASH_ALPHABET = "0123456789bcdefghjkmnpqrstuvwxyz"
+SHARD_MANIFEST = "shards.json"
+
+
+# --------------------------------------------------------------------------- #
+# Geohash
+# --------------------------------------------------------------------------- #
+def geohash_encode(lat: np.ndarray, lng: np.ndarray, precision: int = 3) -> np.ndarray:
+    """Vectorised geohash of (lat, lng) arrays, as a `<U{precision}` array."""
+    if not 1 <= precision <= 12:
+        raise ValueError("geohash precision must be between 1 and 12")
+    n_bits = 5 * precision
+    lng_bits, lat_bits = (n_bits + 1) // 2, n_bits // 2
+    lat_q = np.clip(((np.asarray(lat) + 90.0) / 180.0 * (1 << lat_bits)).astype(np.int64), 0, (1 << lat_bits) - 1)
+    lng_q = np.clip(((np.asarray(lng) + 180.0) / 360.0 * (1 << lng_bits)).astype(np.int64), 0, (1 << lng_bits) - 1)
+
+    # Interleave bits, longitude first, most significant first
+    code = np.zeros(lat_q.shape, dtype=np.int64)
+    for bit in range(n_bits):
+        if bit % 2 == 0:
+            value = (lng_q >> (lng_bits - 1 - bit // 2)) & 1
+        else:
+            value = (lat_q >> (lat_bits - 1 - bit // 2)) & 1
+        code = (code << 1) | value
+
+    digits = np.stack([(code >> (5 * (precision - 1 - i))) & 31 for i in range(precision)], axis=-1)
+    alphabet = np.frombuffer(GEOHASH_ALPHABET.encode(), dtype=np.uint8)
+    chars = np.ascontiguousarray(alphabet[digits])
+    return chars.view(f"S{precision}").reshape(lat_q.shape).astype(str)
+
+
+def geohash_bbox(prefix: str):
+    """(min_lat, min_lng, max_lat, max_lng) of a geohash cell"""
+    lat_lo, lat_hi, lng_lo, lng_hi = -90.0, 90.0, -180.0, 180.0
+    even = True
+    for char in prefix:
+        value = GEOHASH_ALPHABET.index(char)
+        for shift in range(4, -1, -1):
+            bit = (value >> shift) & 1
+            if even:
+                mid = (lng_lo + lng_hi) / 2
+                lng_lo, lng_hi = (mid, lng_hi) if bit else (lng_lo, mid)
+            else:
+                mid = (lat_lo + lat_hi) / 2
+                lat_lo, lat_hi = (mid, lat_hi) if bit else (lat_lo, mid)
+            even = not even
+    return (lat_lo, lng_lo, lat_hi, lng_hi)
+
+
+# --------------------------------------------------------------------------- #
+# Build
+# --------------------------------------------------------------------------- #
+def build_sharded_index(root: str, ids: np.ndarray, embeddings: np.ndarray, coords: np.ndarray,
+                        precision: int = 3) -> Dict[str, dict]:
+    """
+    Split an index into one shard per geohash prefix of length `precision`.
+    Locations without coordinates go to a "_" shard that every search includes.
+    """
+    ids = np.asarray(ids, dtype=str)
+    lat, lng = coords[:, 0], coords[:, 1]
+    valid = np.isfinite(lat) & np.isfinite(lng)
+    keys = np.full(len(ids), "_", dtype=f"<U{precision}")
+    keys[valid] = geohash_encode(lat[valid], lng[valid], precision)
+
+    manifest = {}
+    prefixes, inverse = np.unique(keys, return_inverse=True)
+    order = np.argsort(inverse, kind="stable")
+    bounds = np.cumsum(np.bincount(inverse, minlength=len(prefixes)))
+    for prefix, rows in zip(prefixes, np.split(order, bounds[:-1])):
+        rows = np.sort(rows)
+        save_local_index(os.path.join(root, prefix, "index"), ids[rows], embeddings[rows])
+        if prefix == "_":
+            bbox = None
+        else:
+            bbox = [float(lat[rows].min()), float(lng[rows].min()), float(lat[rows].max()), float(lng[rows].max())]
+        manifest[str(prefix)] = {"bbox": bbox, "count": int(len(rows)),
+                                 "bytes": int(len(rows) * embeddings.shape[1] * 2)}
+
+    with open(os.path.join(root, SHARD_MANIFEST), "w") as f:
+        json.dump({"precision": precision, "shards": manifest}, f, indent=2)
+    print(f"✅ Wrote {len(manifest)} shards to {root}")
+    return manifest
+
+
+# --------------------------------------------------------------------------- #
+# Search
+# --------------------------------------------------------------------------- #
+class ShardedSearchBackend(BaseSearchBackend):
+    """
+    Router over geohash shards.
+
+    A query only fans out to the shards whose bounding box intersects the
+    requested region (all shards when unbounded); shards are searched in
+    parallel and their per-query hit lists merged into the global top-k with a
+    heap. Shards are loaded on first use and the least recently used ones are
+    evicted once the resident shards, including the dense fields full-field
+    searches keep on them, exceed `memory_budget_bytes`.
+    """
+
+    supports_dense_search = True
+
+    def __init__(self, root: str, memory_budget_bytes: int = 4 << 30, workers: int = 8,
+                 mmap: bool = False, nprobe: int = 16):
+        self.root = root
+        with open(os.path.join(root, SHARD_MANIFEST)) as f:
+            manifest = json.load(f)
+        self.precision = manifest["precision"]
+        self.shards: Dict[str, dict] = manifest["shards"]
+        self.memory_budget_bytes = memory_budget_bytes
+        self.mmap = mmap
+        self.nprobe = nprobe
+
+        self._resident: "OrderedDict[str, LocalSearchBackend]" = OrderedDict()
+        self._resident_bytes = 0
+        self._accounted: Dict[str, int] = {}  # bytes counted per resident shard
+        self._lock = threading.Lock()
+        self._load_locks = {prefix: threading.Lock() for prefix in self.shards}
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="planit-shard")
+
+        # Counters
+        self.loads = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return sum(shard["count"] for shard in self.shards.values())
+
+    # ------------------------------------------------------------------ #
+    # Shard cache
+    # ------------------------------------------------------------------ #
+    @staticmethod
+    def _shard_bytes(backend: LocalSearchBackend) -> int:
+        return int(backend.embeddings.nbytes + backend.ids.nbytes + backend.lat.nbytes + backend.lng.nbytes
+                   + backend.dense_bytes)
+
+    def _reaccount(self, prefix: str, backend: LocalSearchBackend):
+        """Recount a shard whose dense fields changed, evicting if over budget."""
+        size = self._shard_bytes(backend)
+        with self._lock:
+            if self._resident.get(prefix) is not backend:
+                return  # evicted meanwhile
+            self._resident_bytes += size - self._accounted[prefix]
+            self._accounted[prefix] = size
+            self._evict(keep=prefix)
+
+    def _get_shard(self, prefix: str) -> LocalSearchBackend:
+        with self._lock:
+            backend = self._resident.get(prefix)
+            if backend is not None:
+                self._resident.move_to_end(prefix)
+                return backend
+        # Load outside the global lock; the per-shard lock stops duplicate loads
+        with self._load_locks[prefix]:
+            with self._lock:
+                backend = self._resident.get(prefix)
+            if backend is None:
+                backend = LocalSearchBackend.from_prefix(os.path.join(self.root, prefix, "index"),
+                                                         nprobe=self.nprobe, mmap=self.mmap)
+                size = self._shard_bytes(backend)
+                with self._lock:
+                    self._resident[prefix] = backend
+                    self._accounted[prefix] = size
+                    self._resident_bytes += size
+                    self.loads += 1
+                    self._evict(keep=prefix)
+        return backend
+
+    def _evict(self, keep: str):
+        """Drop least recently used shards until under budget (caller holds the lock)."""
+        while self._resident_bytes > self.memory_budget_bytes and len(self._resident) > 1:
+            prefix = next(iter(self._resident))
+            if prefix == keep:
+                self._resident.move_to_end(prefix)
+                continue
+            self._resident.pop(prefix)
+            self._resident_bytes -= self._accounted.pop(prefix)
+            self.evictions += 1
+            # In-flight searches still hold a reference; memory goes when they finish
+
+    def preload(self, prefixes: List[str]):
+        """Load the given shards up front (e.g. the hot cities), within the budget."""
+        for prefix in prefixes:
+            if prefix in self.shards:
+                self._get_shard(prefix)
+            else:
+                print(f"⚠️  Unknown shard '{prefix}', not preloaded")
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "shards": len(self.shards),
+                "resident": list(self._resident),
+                "resident_bytes": self._resident_bytes,
+                "memory_budget_bytes": self.memory_budget_bytes,
+                "loads": self.loads,
+                "evictions": self.evictions,
+            }
+
+    # ------------------------------------------------------------------ #
+    # Routing + merge
+    # ------------------------------------------------------------------ #
+    def route(self, region: Optional[GeoRegion] = None) -> List[str]:
+        """Shards a search over `region` has to visit."""
+        if region is None:
+            return list(self.shards)
+        bbox = region.bbox()
+        return [prefix for prefix, shard in self.shards.items()
+                if shard["bbox"] is None or bbox_intersects(bbox, shard["bbox"])]
+
+    def _search_shard(self, prefix: str, queries: np.ndarray, top_k: int,
+                      region: Optional[GeoRegion]) -> List[SearchHits]:
+        return self._get_shard(prefix).search(queries, top_k, region=region)
+
+    @staticmethod
+    def _merge(shard_hits: List[SearchHits], top_k: int) -> SearchHits:
+        """Global top-k of several best-first hit lists via a k-way heap merge."""
+        # zip/repeat bind each shard's index now; a nested generator would read
+        # `s` only once heapq.merge runs, after the loop has moved on
+        streams = [zip((-hits.scores.astype(np.float64)).tolist(), repeat(s), count())
+                   for s, hits in enumerate(shard_hits)]
+        best = list(islice(heapq.merge(*streams), top_k))
+        if not best:
+            empty = np.empty(0)
+            return SearchHits(np.empty(0, dtype=object), empty.astype(np.float32), empty, empty)
+        shard_idx = np.array([s for _, s, _ in best])
+        row_idx = np.array([i for _, _, i in best])
+        columns = []
+        for field in SearchHits._fields:
+            parts = [getattr(hits, field) for hits in shard_hits]
+            offsets = np.concatenate([[0], np.cumsum([len(p) for p in parts])[:-1]])
+            columns.append(np.concatenate(parts)[offsets[shard_idx] + row_idx])
+        return SearchHits(*columns)
+
+    def search(self, query_embeddings: np.ndarray, top_k: int,
+               region: Optional[GeoRegion] = None) -> List[SearchHits]:
+        queries = np.asarray(query_embeddings, dtype=np.float32)
+        prefixes = self.route(region)
+        if not prefixes:
+            return [self._merge([], top_k) for _ in queries]
+        futures = [self._pool.submit(self._search_shard, prefix, queries, top_k, region) for prefix in prefixes]
+        per_shard = [future.result() for future in futures]  # [shard][query]
+        return [self._merge([hits[q] for hits in per_shard], top_k) for q in range(len(queries))]
+
+    def _dense_shard(self, prefix: str, queries: np.ndarray, region: Optional[GeoRegion]) -> List[SearchHits]:
+        backend = self._get_shard(prefix)
+        hits = backend.dense_search(queries, region=region)
+        # The shard may have just built a dense field; count it against the budget
+        self._reaccount(prefix, backend)
+        return hits
+
+    def dense_search(self, query_embeddings: np.ndarray,
+                     region: Optional[GeoRegion] = None) -> List[SearchHits]:
+        """Full-field scores of every routed shard, concatenated per query."""
+        queries = np.asarray(query_embeddings, dtype=np.float32)
+        prefixes = self.route(region)
+        futures = [self._pool.submit(self._dense_shard, prefix, queries, region) for prefix in prefixes]
+        per_shard = [future.result() for future in futures]  # [shard][query]
+        if not per_shard:
+            return [self._merge([], 0) for _ in queries]
+        return [SearchHits(*(np.concatenate([getattr(hits[q], field) for hits in per_shard])
+                             for field in SearchHits._fields))
+                for q in range(len(queries))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Split a local index into geohash shards")
+    parser.add_argument("--index", required=True, help="Local index prefix to shard")
+    parser.add_argument("--out", required=True, help="Output directory for the shards")
+    parser.add_argument("--precision", type=int, default=3, help="Geohash prefix length (3 ~ 156 km cells)")
+    args = parser.parse_args()
+
+    source = LocalSearchBackend.from_prefix(args.index)
+    coords = np.column_stack([source.lat, source.lng])
+    build_sharded_index(args.out, source.ids, source.embeddings, coords, precision=args.precision)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,285 @@
+import asyncio
+import contextlib
+import json
+import os
+import random
+import time
+from io import BytesIO
+
+import aiohttp
+from PIL import Image
+from tqdm import tqdm
+
+from ingest_manifest import OK, NO_PANO, FAILED, DUPLICATE
+
+METADATA_URL = "https://maps.googleapis.com/maps/api/streetview/metadata?location={lat},{lon}&key={key}"
+TILE_URL = os.environ.get(
+    'STREETVIEW_TILE_URL',
+    "https://cbk0.googleapis.com/cbk?output=tile&panoid={panoid}&zoom={zoom}&x={x}&y={y}"
+)
+
+# HTTP statuses worth retrying, and metadata statuses that mean "try again later"
+RETRY_HTTP_STATUSES = {429, 500, 502, 503, 504}
+RETRY_META_STATUSES = {'OVER_QUERY_LIMIT', 'UNKNOWN_ERROR'}
+# Metadata statuses that mean there is no panorama here; anything else that is
+# not OK (REQUEST_DENIED, INVALID_REQUEST, ...) is a failure to retry next run
+NO_PANO_META_STATUSES = {'ZERO_RESULTS', 'NOT_FOUND'}
+
+# Row outcomes: manifest statuses plus SKIPPED (already done / seen this run)
+SKIPPED = 'skipped'
+
+
+class TokenBucket:
+    """Async token-bucket rate limiter: `rate` requests/second, bursts up to `capacity`"""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity or max(1.0, rate))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        # Waiters queue on the lock, so tokens are handed out in FIFO order
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class RetryableError(Exception):
+    pass
+
+
+class StreetViewClient:
+    """
+    Rate-limited, retrying Street View HTTP client shared by the ingestor and
+    the metadata probe (get_new_coordinates.py).
+
+    - one token bucket per endpoint (metadata vs tiles)
+    - exponential backoff with jitter on 429/5xx, network errors and OVER_QUERY_LIMIT
+    - one pooled aiohttp session, opened with `async with client.open():`
+    """
+
+    def __init__(self, api_key, concurrency=32, metadata_rate=50, tile_rate=200,
+                 max_retries=5, base_delay=0.5, max_delay=30.0, timeout=30):
+        self.api_key = api_key
+        self.concurrency = concurrency
+        self.metadata_bucket = TokenBucket(metadata_rate)
+        self.tile_bucket = TokenBucket(tile_rate)
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self.retries = 0
+        self.session = None
+
+    @contextlib.asynccontextmanager
+    async def open(self):
+        connector = aiohttp.TCPConnector(limit=self.concurrency * 4)
+        async with aiohttp.ClientSession(connector=connector, timeout=self.timeout) as session:
+            self.session = session
+            try:
+                yield self
+            finally:
+                self.session = None
+
+    # ------------------------------------------------------------------ #
+    # HTTP with rate limiting + retries
+    # ------------------------------------------------------------------ #
+    async def _request(self, url, bucket, parse):
+        """GET `url` through `bucket`; `parse(resp)` may raise RetryableError"""
+        for attempt in range(self.max_retries + 1):
+            await bucket.acquire()
+            retry_after = None
+            try:
+                async with self.session.get(url) as resp:
+                    if resp.status in RETRY_HTTP_STATUSES:
+                        retry_after = resp.headers.get('Retry-After')
+                        raise RetryableError(f"HTTP {resp.status}")
+                    return await parse(resp)
+            except (RetryableError, aiohttp.ClientError, asyncio.TimeoutError) as e:
+                if attempt == self.max_retries:
+                    print(f"Giving up on {url.split('key=')[0]} after {attempt + 1} attempts: {e}")
+                    return None
+                self.retries += 1
+                delay = min(self.max_delay, self.base_delay * 2 ** attempt) * random.uniform(0.5, 1.5)
+                if retry_after and retry_after.isdigit():
+                    delay = max(delay, float(retry_after))
+                await asyncio.sleep(delay)
+
+    async def get_metadata(self, lat, lon):
+        async def parse(resp):
+            meta = await resp.json(content_type=None)
+            if meta.get('status') in RETRY_META_STATUSES:
+                raise RetryableError(meta.get('status'))
+            return meta
+
+        url = METADATA_URL.format(lat=lat, lon=lon, key=self.api_key)
+        return await self._request(url, self.metadata_bucket, parse)
+
+
+class StreetViewIngestor(StreetViewClient):
+    """
+    Asyncio Street View ingestion: metadata lookup, concurrent tile download,
+    stitching and saving, for many coordinates at once.
+
+    `concurrency` coordinates are in flight at a time; HTTP goes through
+    StreetViewClient's rate limiting and retries.
+    """
+
+    def __init__(self, api_key, image_folder='./images', zoom=2, concurrency=32,
+                 metadata_rate=50, tile_rate=200, max_retries=5, base_delay=0.5,
+                 max_delay=30.0, timeout=30, manifest=None):
+        super().__init__(api_key, concurrency=concurrency, metadata_rate=metadata_rate,
+                         tile_rate=tile_rate, max_retries=max_retries, base_delay=base_delay,
+                         max_delay=max_delay, timeout=timeout)
+        # Optional IngestManifest: replaces pano.jpg probing and persists outcomes
+        self.manifest = manifest
+        self.image_folder = image_folder
+        self.zoom = zoom
+
+        self.seen_coords = set()
+        self.seen_pano_ids = set()
+        self.counts = {OK: 0, NO_PANO: 0, FAILED: 0, DUPLICATE: 0, SKIPPED: 0}
+
+    async def get_tile(self, panoid, x, y):
+        async def parse(resp):
+            if resp.status != 200:
+                print(f"Failed to download tile {x},{y} for pano {panoid}: {resp.status}")
+                return None
+            return await resp.read()
+
+        url = TILE_URL.format(panoid=panoid, zoom=self.zoom, x=x, y=y)
+        return await self._request(url, self.tile_bucket, parse)
+
+    async def download_pano(self, panoid):
+        """Fetch all tiles of a pano concurrently; stitch off the event loop"""
+        num_x, num_y = 2 ** self.zoom, 2 ** (self.zoom - 1)
+        coords = [(x, y) for x in range(num_x) for y in range(num_y)]
+        tiles = await asyncio.gather(*(self.get_tile(panoid, x, y) for x, y in coords))
+        if any(t is None for t in tiles):
+            return None
+        return await asyncio.to_thread(stitch_tiles, dict(zip(coords, tiles)), num_x, num_y)
+
+    # ------------------------------------------------------------------ #
+    # Per-coordinate pipeline
+    # ------------------------------------------------------------------ #
+    async def process(self, lat, lon):
+        """Ingest one coordinate; returns OK, NO_PANO, FAILED, DUPLICATE or SKIPPED"""
+        ck = f"{lat}_{lon}"
+        if ck in self.seen_coords:
+            return SKIPPED
+        self.seen_coords.add(ck)
+
+        cache_dir = os.path.join(self.image_folder, ck)
+        if self.manifest is not None:
+            # One indexed lookup instead of probing the image directory
+            if self.manifest.should_skip(lat, lon):
+                return SKIPPED
+        elif await asyncio.to_thread(os.path.exists, os.path.join(cache_dir, 'pano.jpg')):
+            return SKIPPED
+
+        outcome, pano_id, meta = await self._ingest(lat, lon, cache_dir)
+        if self.manifest is not None:
+            self.manifest.record(lat, lon, outcome, pano_id=pano_id,
+                                 date=meta.get('date') if meta else None)
+            # The manifest now answers for this coordinate/pano, so the in-memory
+            # sets only need to cover in-flight work and stay small on huge inputs
+            self.seen_coords.discard(ck)
+            if outcome == OK:
+                self.seen_pano_ids.discard(pano_id)
+        return outcome
+
+    async def _ingest(self, lat, lon, cache_dir):
+        """Metadata -> pano de-dupe -> download -> save; returns (outcome, pano_id, meta)"""
+        meta = await self.get_metadata(lat, lon)
+        if meta is None:
+            return FAILED, None, None
+        status = meta.get('status')
+        if status in NO_PANO_META_STATUSES:
+            return NO_PANO, None, meta
+        if status != 'OK':
+            print(f"Metadata request for {lat},{lon} failed: {status} {meta.get('error_message', '')}")
+            return FAILED, None, meta
+
+        pano_id = meta.get('pano_id') or meta.get('panoId')
+        if not pano_id:
+            return NO_PANO, None, meta
+
+        # de-dupe by pano_id across different coords (and across runs)
+        if pano_id in self.seen_pano_ids or (self.manifest is not None and self.manifest.has_pano(pano_id)):
+            return DUPLICATE, pano_id, meta
+        self.seen_pano_ids.add(pano_id)
+
+        pano_img = await self.download_pano(pano_id)
+        if pano_img is None:
+            # Let a later coordinate (or run) try this pano again
+            self.seen_pano_ids.discard(pano_id)
+            return FAILED, pano_id, meta
+
+        await asyncio.to_thread(save_panorama, cache_dir, pano_img, meta)
+        return OK, pano_id, meta
+
+    async def run(self, rows, on_result=None, total=None):
+        """
+        Process `rows` (iterable of (key, lat, lon)) with `concurrency` workers.
+
+        At most ~2x`concurrency` rows are buffered, so `rows` may be a lazy stream.
+        `on_result(key, lat, lon, outcome)` is called as each row finishes.
+        """
+        queue = asyncio.Queue(maxsize=2 * self.concurrency)
+        progress = tqdm(total=total, desc="Downloading")
+
+        async def worker():
+            while True:
+                item = await queue.get()
+                if item is None:
+                    return
+                key, lat, lon = item
+                try:
+                    outcome = await self.process(lat, lon)
+                except Exception as e:
+                    print(f"Error processing {lat},{lon}: {e}")
+                    outcome = FAILED
+                self.counts[outcome] += 1
+                if on_result is not None:
+                    on_result(key, lat, lon, outcome)
+                progress.update(1)
+                progress.set_postfix(ok=self.counts[OK], no_pano=self.counts[NO_PANO],
+                                     failed=self.counts[FAILED], dup=self.counts[DUPLICATE],
+                                     retries=self.retries)
+
+        async with self.open():
+            workers = [asyncio.create_task(worker()) for _ in range(self.concurrency)]
+            for row in rows:
+                await queue.put(row)
+            for _ in workers:
+                await queue.put(None)
+            await asyncio.gather(*workers)
+        progress.close()
+        if self.manifest is not None:
+            self.manifest.commit()
+        return dict(self.counts)
+
+
+def stitch_tiles(tiles, num_x, num_y):
+    """Decode tile bytes and paste them into one preallocated panorama"""
+    decoded = {xy: Image.open(BytesIO(data)) for xy, data in tiles.items()}
+    tile_size = decoded[(0, 0)].size[0]  # Assuming square tiles
+    pano_img = Image.new('RGB', (num_x * tile_size, num_y * tile_size))
+    for (x, y), tile in decoded.items():
+        pano_img.paste(tile, (x * tile_size, y * tile_size))
+    return pano_img
+
+
+def save_panorama(cache_dir, pano_img, meta):
+    os.makedirs(cache_dir, exist_ok=True)
+    pano_img.save(os.path.join(cache_dir, 'pano.jpg'))
+    with open(os.path.join(cache_dir, 'metadata.json'), 'w') as f:
+        json.dump(meta, f, indent=2)
@@ -0,0 +1,101 @@
+import numpy as np
+import pandas as pd
+from scipy.spatial import cKDTree
+
+EARTH_RADIUS_M = 6371008.8
+
+
+def parse_coordinate_ids(raw_list):
+    """
+    Parse `{lat}_{lon}` ids (e.g. image directory names) in bulk.
+    Malformed entries are dropped. Returns an (N, 2) float64 array of (lat, lon).
+    """
+    s = pd.Series(list(raw_list), dtype=str).str.strip().str.strip(", '\"")
+    parts = s.str.split('_', n=1, expand=True)
+    if parts.shape[1] < 2:
+        return np.empty((0, 2))
+    lat = pd.to_numeric(parts[0], errors='coerce')
+    lon = pd.to_numeric(parts[1], errors='coerce')
+    coords = np.column_stack([lat.to_numpy(float), lon.to_numpy(float)])
+    return coords[~np.isnan(coords).any(axis=1)]
+
+
+def project_local(coords, origin=None):
+    """Equirectangular projection to metres around `origin` (default: centroid)"""
+    if origin is None:
+        origin = coords.mean(axis=0)
+    lat0 = np.radians(origin[0])
+    x = np.radians(coords[:, 1] - origin[1]) * np.cos(lat0) * EARTH_RADIUS_M
+    y = np.radians(coords[:, 0] - origin[0]) * EARTH_RADIUS_M
+    return np.column_stack([x, y])
+
+
+def great_circle_midpoints(p1, p2):
+    """Vectorised great-circle midpoints of two (N, 2) (lat, lon) arrays, in degrees"""
+    lat1, lon1 = np.radians(p1[:, 0]), np.radians(p1[:, 1])
+    lat2, lon2 = np.radians(p2[:, 0]), np.radians(p2[:, 1])
+    dlon = lon2 - lon1
+    bx = np.cos(lat2) * np.cos(dlon)
+    by = np.cos(lat2) * np.sin(dlon)
+    lat3 = np.arctan2(np.sin(lat1) + np.sin(lat2), np.sqrt((np.cos(lat1) + bx) ** 2 + by ** 2))
+    lon3 = lon1 + np.arctan2(by, np.cos(lat1) + bx)
+    return np.column_stack([np.degrees(lat3), (np.degrees(lon3) + 540) % 360 - 180])
+
+
+def neighbour_pairs(xy, k=6, min_gap_m=15.0, max_gap_m=120.0):
+    """
+    Index pairs (i < j) of spatial nearest neighbours whose distance is a
+    street-like gap: large enough to be worth filling, small enough that the
+    midpoint is likely still on the same street.
+    """
+    tree = cKDTree(xy)
+    k = min(k + 1, len(xy))
+    dist, idx = tree.query(xy, k=k)
+    src = np.repeat(np.arange(len(xy)), k - 1)
+    dst = idx[:, 1:].ravel()
+    d = dist[:, 1:].ravel()
+    keep = (d >= min_gap_m) & (d <= max_gap_m) & np.isfinite(d)
+    pairs = np.sort(np.column_stack([src[keep], dst[keep]]), axis=1)
+    return np.unique(pairs, axis=0)
+
+
+def dedupe_candidates(candidates, existing, radius_m=10.0):
+    """
+    Drop candidates within `radius_m` of existing coverage or of each other.
+    Returns the surviving (M, 2) (lat, lon) candidates.
+    """
+    if len(candidates) == 0:
+        return candidates
+    origin = existing.mean(axis=0) if len(existing) else candidates.mean(axis=0)
+    cand_xy = project_local(candidates, origin)
+
+    # Collapse candidates that fall in the same radius-sized grid cell
+    cells = np.floor(cand_xy / radius_m).astype(np.int64)
+    _, first = np.unique(cells, axis=0, return_index=True)
+    first = np.sort(first)
+    candidates, cand_xy = candidates[first], cand_xy[first]
+
+    if len(existing):
+        dist, _ = cKDTree(project_local(existing, origin)).query(cand_xy, distance_upper_bound=radius_m)
+        keep = ~np.isfinite(dist)
+        candidates = candidates[keep]
+    return candidates
+
+
+def densify(existing, k=6, min_gap_m=15.0, max_gap_m=120.0, dedupe_radius_m=10.0):
+    """
+    Candidate coordinates between true spatial neighbours of `existing` (N, 2).
+
+    1. project to local metres and build a KD-tree
+    2. take each point's k nearest neighbours at street-like gap distances
+    3. one batched great-circle midpoint computation over all pairs
+    4. drop candidates already covered within `dedupe_radius_m`
+    """
+    if len(existing) < 2:
+        return np.empty((0, 2))
+    xy = project_local(existing)
+    pairs = neighbour_pairs(xy, k=k, min_gap_m=min_gap_m, max_gap_m=max_gap_m)
+    if len(pairs) == 0:
+        return np.empty((0, 2))
+    mids = great_circle_midpoints(existing[pairs[:, 0]], existing[pairs[:, 1]])
+    return dedupe_candidates(mids, existing, radius_m=dedupe_radius_m)
@@ -0,0 +1,254 @@
+import json
+import os
+import sqlite3
+import time
+
+# Coordinate statuses
+OK, NO_PANO, FAILED, DUPLICATE = 'ok', 'no-pano', 'failed', 'duplicate'
+FINAL_STATUSES = (OK, NO_PANO, DUPLICATE)
+
+DEFAULT_MANIFEST_PATH = './images_manifest.sqlite'
+
+# Metadata probes are cached per ~1m cell (5 decimal places)
+PROBE_DECIMALS = 5
+
+
+def coord_key(lat, lon):
+    """Same `{lat}_{lon}` key used for the image directories"""
+    return f"{lat}_{lon}"
+
+
+def probe_key(lat, lon):
+    """Metadata probe cache key: coordinate rounded to PROBE_DECIMALS"""
+    # + 0.0 folds -0.0 into 0.0 so both sides of the equator/meridian agree
+    lat, lon = round(float(lat), PROBE_DECIMALS) + 0.0, round(float(lon), PROBE_DECIMALS) + 0.0
+    return f"{lat:.{PROBE_DECIMALS}f}_{lon:.{PROBE_DECIMALS}f}"
+
+
+def file_identity(path):
+    """'size:mtime_ns' of a file, so a checkpoint can tell it was rewritten"""
+    st = os.stat(path)
+    return f"{st.st_size}:{st.st_mtime_ns}"
+
+
+class IngestManifest:
+    """
+    Persistent record of street-view ingestion, in one sqlite file.
+
+    coords: one row per coordinate -> status (ok/no-pano/failed/duplicate),
+            pano_id and number of attempts
+    panos:  one row per downloaded pano_id, so panoramas are de-duplicated
+            across runs, not just within one
+    checkpoints: per input file, how many leading rows are fully processed,
+                 along with the file's size and mtime at the time
+    probes: cached Street View metadata lookups keyed by rounded coordinate
+            (see probe_key), so densification passes never re-probe a point
+
+    Writes are committed every `commit_every` records (and on close), so a
+    crash loses at most that many outcomes.
+    """
+
+    def __init__(self, path, max_attempts=3, commit_every=100):
+        self.path = path
+        self.max_attempts = max_attempts
+        self.commit_every = commit_every
+        self._pending = 0
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS coords (
+                key TEXT PRIMARY KEY,
+                lat REAL NOT NULL,
+                lon REAL NOT NULL,
+                status TEXT NOT NULL,
+                pano_id TEXT,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                updated_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS coords_pano_id ON coords (pano_id);
+            CREATE TABLE IF NOT EXISTS panos (
+                pano_id TEXT PRIMARY KEY,
+                key TEXT NOT NULL,
+                date TEXT,
+                updated_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS checkpoints (
+                source TEXT PRIMARY KEY,
+                rows_done INTEGER NOT NULL,
+                updated_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS probes (
+                key TEXT PRIMARY KEY,
+                status TEXT NOT NULL,
+                pano_id TEXT,
+                date TEXT,
+                probed_at REAL NOT NULL
+            );
+        """)
+        # Manifests written before output sizes were checkpointed
+        columns = {r[1] for r in self.conn.execute("PRAGMA table_info(checkpoints)")}
+        if 'outputs' not in columns:
+            self.conn.execute("ALTER TABLE checkpoints ADD COLUMN outputs TEXT")
+        if 'identity' not in columns:
+            self.conn.execute("ALTER TABLE checkpoints ADD COLUMN identity TEXT")
+        self.conn.commit()
+
+    # ------------------------------------------------------------------ #
+    # Lookups
+    # ------------------------------------------------------------------ #
+    def should_skip(self, lat, lon):
+        """True if this coordinate is finished, or failed too many times"""
+        row = self.conn.execute(
+            "SELECT status, attempts FROM coords WHERE key = ?", (coord_key(lat, lon),)
+        ).fetchone()
+        if row is None:
+            return False
+        status, attempts = row
+        return status in FINAL_STATUSES or attempts >= self.max_attempts
+
+    def status(self, lat, lon):
+        """Recorded status of a coordinate, or None"""
+        row = self.conn.execute(
+            "SELECT status FROM coords WHERE key = ?", (coord_key(lat, lon),)
+        ).fetchone()
+        return row[0] if row else None
+
+    def has_pano(self, pano_id):
+        """True if this pano was already downloaded (in this run or an earlier one)"""
+        return self.conn.execute(
+            "SELECT 1 FROM panos WHERE pano_id = ?", (pano_id,)
+        ).fetchone() is not None
+
+    def known_pano_ids(self):
+        """Every pano_id already downloaded or referenced by a coordinate"""
+        rows = self.conn.execute(
+            "SELECT pano_id FROM panos UNION SELECT pano_id FROM coords WHERE pano_id IS NOT NULL"
+        )
+        return {r[0] for r in rows}
+
+    def get_probes(self, keys):
+        """Cached probe results for `keys` -> {key: (status, pano_id, date)}"""
+        found = {}
+        keys = list(keys)
+        # Stay under sqlite's bound-parameter limit
+        for i in range(0, len(keys), 500):
+            chunk = keys[i:i + 500]
+            rows = self.conn.execute(
+                f"SELECT key, status, pano_id, date FROM probes WHERE key IN ({','.join('?' * len(chunk))})",
+                chunk
+            )
+            for key, status, pano_id, date in rows:
+                found[key] = (status, pano_id, date)
+        return found
+
+    # ------------------------------------------------------------------ #
+    # Updates
+    # ------------------------------------------------------------------ #
+    def record(self, lat, lon, status, pano_id=None, date=None):
+        now = time.time()
+        key = coord_key(lat, lon)
+        self.conn.execute(
+            """INSERT INTO coords (key, lat, lon, status, pano_id, attempts, updated_at)
+               VALUES (?, ?, ?, ?, ?, 1, ?)
+               ON CONFLICT(key) DO UPDATE SET
+                   status = excluded.status,
+                   pano_id = COALESCE(excluded.pano_id, coords.pano_id),
+                   attempts = coords.attempts + 1,
+                   updated_at = excluded.updated_at""",
+            (key, float(lat), float(lon), status, pano_id, now)
+        )
+        if status == OK and pano_id:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO panos (pano_id, key, date, updated_at) VALUES (?, ?, ?, ?)",
+                (pano_id, key, date, now)
+            )
+        self._pending += 1
+        if self._pending >= self.commit_every:
+            self.commit()
+
+    def record_probe(self, key, status, pano_id=None, date=None):
+        self.conn.execute(
+            "INSERT OR REPLACE INTO probes (key, status, pano_id, date, probed_at) VALUES (?, ?, ?, ?, ?)",
+            (key, status, pano_id, date, time.time())
+        )
+        self._pending += 1
+        if self._pending >= self.commit_every:
+            self.commit()
+
+    def get_checkpoint(self, source):
+        """
+        (rows_done, outputs) for input `source`: the number of leading rows
+        already fully processed, and the state of its output files at that row
+        ({"kept": bytes, "dropped": bytes, "rows_written": n}; None for
+        checkpoints written before it was tracked).
+
+        A checkpoint only applies to the file it was taken on: if `source` has
+        been rewritten since (different size or mtime, e.g. a regenerated
+        new_coordinates.csv), this returns (0, None) so the run starts over.
+        """
+        row = self.conn.execute(
+            "SELECT rows_done, outputs, identity FROM checkpoints WHERE source = ?", (os.path.abspath(source),)
+        ).fetchone()
+        if row is None:
+            return 0, None
+        if row[2] != file_identity(source):
+            print(f"⚠️  {source} changed since its checkpoint, starting from the top")
+            return 0, None
+        return row[0], json.loads(row[1]) if row[1] else None
+
+    def set_checkpoint(self, source, rows_done, outputs=None):
+        self.conn.execute(
+            "INSERT OR REPLACE INTO checkpoints (source, rows_done, outputs, identity, updated_at) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (os.path.abspath(source), int(rows_done), json.dumps(outputs) if outputs is not None else None,
+             file_identity(source), time.time())
+        )
+        self.commit()
+
+    def commit(self):
+        self.conn.commit()
+        self._pending = 0
+
+    def close(self):
+        self.commit()
+        self.conn.close()
+
+    def summary(self):
+        return dict(self.conn.execute("SELECT status, COUNT(*) FROM coords GROUP BY status").fetchall())
+
+    # ------------------------------------------------------------------ #
+    # Bootstrap from an existing image store
+    # ------------------------------------------------------------------ #
+    def is_empty(self):
+        return self.conn.execute("SELECT 1 FROM coords LIMIT 1").fetchone() is None
+
+    def import_image_folder(self, image_folder):
+        """
+        One-time scan of `{image_folder}/{lat}_{lon}/pano.jpg` so images downloaded
+        before the manifest existed are not fetched again.
+        """
+        imported = 0
+        if not os.path.isdir(image_folder):
+            return imported
+        for entry in os.scandir(image_folder):
+            if not entry.is_dir() or '_' not in entry.name:
+                continue
+            if not os.path.exists(os.path.join(entry.path, 'pano.jpg')):
+                continue
+            lat, _, lon = entry.name.partition('_')
+            meta = {}
+            meta_file = os.path.join(entry.path, 'metadata.json')
+            if os.path.exists(meta_file):
+                with open(meta_file) as f:
+                    meta = json.load(f)
+            try:
+                self.record(float(lat), float(lon), OK,
+                            pano_id=meta.get('pano_id') or meta.get('panoId'), date=meta.get('date'))
+            except ValueError:
+                continue
+            imported += 1
+        self.commit()
+        return imported
@@ -0,0 +1,97 @@
+import asyncio
+
+from tqdm import tqdm
+
+from async_ingest import StreetViewClient, NO_PANO_META_STATUSES
+from ingest_manifest import probe_key
+
+# Probe outcomes: the metadata status as returned by Google ('OK', 'ZERO_RESULTS', ...)
+# or FAILED when every retry was exhausted or the response was unusable
+PROBE_FAILED = 'failed'
+# Only definitive answers are cached; REQUEST_DENIED, INVALID_REQUEST and
+# failures are probed again next pass
+CACHED_PROBE_STATUSES = {'OK'} | NO_PANO_META_STATUSES
+
+
+class MetadataProbe(StreetViewClient):
+    """
+    Bounded Street View metadata probing for candidate coordinates.
+
+    - one pooled session and the metadata token bucket from StreetViewClient
+    - at most `concurrency` lookups in flight
+    - results cached in the manifest's `probes` table by rounded coordinate,
+      so a point is probed at most once across densification passes
+    """
+
+    def __init__(self, api_key, manifest, concurrency=32, metadata_rate=50,
+                 max_retries=5, timeout=30):
+        super().__init__(api_key, concurrency=concurrency, metadata_rate=metadata_rate,
+                         max_retries=max_retries, timeout=timeout)
+        self.manifest = manifest
+        self.cache_hits = 0
+
+    async def probe(self, lat, lon):
+        """(status, pano_id, date) for one coordinate"""
+        meta = await self.get_metadata(lat, lon)
+        if meta is None:
+            return PROBE_FAILED, None, None
+        return meta.get('status'), meta.get('pano_id') or meta.get('panoId'), meta.get('date')
+
+    async def probe_all(self, coords):
+        """
+        Probe every (lat, lon) in `coords`.
+        Returns a list of (lat, lon, status, pano_id, date) in input order.
+        """
+        keys = [probe_key(lat, lon) for lat, lon in coords]
+        cached = self.manifest.get_probes(set(keys))
+        results = [None] * len(coords)
+
+        todo = []
+        for i, ((lat, lon), key) in enumerate(zip(coords, keys)):
+            # Older manifests also cached transient statuses such as REQUEST_DENIED
+            if key in cached and cached[key][0] in CACHED_PROBE_STATUSES:
+                results[i] = (lat, lon) + cached[key]
+            else:
+                todo.append(i)
+        self.cache_hits = len(coords) - len(todo)
+        print(f"Probe cache: {self.cache_hits} hits, {len(todo)} to probe")
+
+        # Duplicated rounded keys in one pass are probed once
+        first_for_key = {}
+        for i in todo:
+            first_for_key.setdefault(keys[i], i)
+
+        queue = asyncio.Queue(maxsize=2 * self.concurrency)
+        probed = {}
+        progress = tqdm(total=len(first_for_key), desc="Probing")
+
+        async def worker():
+            while True:
+                i = await queue.get()
+                if i is None:
+                    return
+                lat, lon = coords[i]
+                try:
+                    status, pano_id, date = await self.probe(lat, lon)
+                except Exception as e:
+                    # e.g. a 200 with a non-JSON body; one bad response must not stop the worker
+                    print(f"Error probing {lat},{lon}: {e}")
+                    status, pano_id, date = PROBE_FAILED, None, None
+                probed[keys[i]] = (status, pano_id, date)
+                if status in CACHED_PROBE_STATUSES:
+                    self.manifest.record_probe(keys[i], status, pano_id=pano_id, date=date)
+                progress.update(1)
+
+        async with self.open():
+            workers = [asyncio.create_task(worker()) for _ in range(self.concurrency)]
+            for i in first_for_key.values():
+                await queue.put(i)
+            for _ in workers:
+                await queue.put(None)
+            await asyncio.gather(*workers)
+        progress.close()
+        self.manifest.commit()
+
+        for i in todo:
+            results[i] = coords[i] + probed[keys[i]]
+        return results
@@ -0,0 +1,110 @@
+import csv
+import os
+
+import pandas as pd
+
+
+def iter_coordinate_rows(csv_file, start_row=0, chunksize=10000, limit=None):
+    """
+    Stream `csv_file` in chunks, yielding (row_no, row_dict) from `start_row` on.
+    Only one chunk is held in memory at a time.
+    """
+    remaining = limit
+    # A callable, not range(): pandas would materialise the range as a set
+    reader = pd.read_csv(csv_file, chunksize=chunksize,
+                         skiprows=(lambda i: 0 < i <= start_row) if start_row else None)
+    row_no = start_row
+    for chunk in reader:
+        for row in chunk.to_dict('records'):
+            if remaining is not None:
+                if remaining <= 0:
+                    return
+                remaining -= 1
+            yield row_no, row
+            row_no += 1
+
+
+class OrderedResultWriter:
+    """
+    Append finished rows to a "kept" and a "dropped" CSV in input order.
+
+    Results arrive out of order; they are buffered until every earlier row is
+    done, then written: all rows before `rows_done` are on disk, none after it.
+
+    `checkpoint()` is the point to resume from: `rows_done`, or the first row
+    added with `retry=True` so the next run processes it again, together with
+    the output file sizes at that row. Pass those sizes back as `outputs` to
+    cut the files to the resume point; `outputs={}` starts them empty and
+    `outputs=None` appends to whatever is there.
+    """
+
+    def __init__(self, kept_path, dropped_path, start_row=0, outputs=None):
+        self.paths = {'kept': kept_path, 'dropped': dropped_path}
+        self.files = {}
+        self.writers = {}
+        self.rows_done = start_row
+        self._buffer = {}
+        self._retry_point = None  # (row_no, sizes) of the first row to retry
+
+        if outputs is not None:
+            for name, path in self.paths.items():
+                size = int(outputs.get(name, 0))
+                if os.path.exists(path):
+                    with open(path, 'r+b') as f:
+                        f.truncate(min(size, os.path.getsize(path)))
+
+    def _writer(self, name, row):
+        if name not in self.writers:
+            path = self.paths[name]
+            new_file = not os.path.exists(path) or os.path.getsize(path) == 0
+            self.files[name] = open(path, 'a', newline='')
+            self.writers[name] = csv.DictWriter(self.files[name], fieldnames=list(row.keys()))
+            if new_file:
+                self.writers[name].writeheader()
+        return self.writers[name]
+
+    def sizes(self):
+        """Current byte size of each output file"""
+        sizes = {}
+        for name, path in self.paths.items():
+            f = self.files.get(name)
+            if f is not None:
+                f.flush()
+                sizes[name] = f.tell()
+            else:
+                sizes[name] = os.path.getsize(path) if os.path.exists(path) else 0
+        return sizes
+
+    def checkpoint(self):
+        """(resume row, output sizes at that row)"""
+        if self._retry_point is not None:
+            return self._retry_point
+        return self.rows_done, self.sizes()
+
+    def add(self, row_no, row, status, dropped, retry=False):
+        """Record the outcome of `row_no`; returns how many rows were written"""
+        self._buffer[row_no] = (row, status, dropped, retry)
+        written = 0
+        while self.rows_done in self._buffer:
+            row, status, dropped, retry = self._buffer.pop(self.rows_done)
+            if retry and self._retry_point is None:
+                self._retry_point = (self.rows_done, self.sizes())
+            out = dict(row, status=status)
+            self._writer('dropped' if dropped else 'kept', out).writerow(out)
+            self.rows_done += 1
+            written += 1
+        return written
+
+    @property
+    def pending(self):
+        return len(self._buffer)
+
+    def flush(self):
+        for f in self.files.values():
+            f.flush()
+            os.fsync(f.fileno())
+
+    def close(self):
+        self.flush()
+        for f in self.files.values():
+            f.close()
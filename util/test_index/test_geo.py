@@ -0,0 +1,48 @@
+# region filters (the Milvus scalar expression must be plain numbers) and city lookup
+#
+#   python -m pytest util/test_index/test_geo.py
+
+import sys
+import os
+import re
+from types import SimpleNamespace
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import pytest
+from geo import BBoxRegion, CircleRegion, CityBoundsResolver, PolygonRegion
+
+NUMBER = r"-?\d+(\.\d+)?(e-?\d+)?"
+EXPR = re.compile(rf"lat >= {NUMBER} and lat <= {NUMBER} and lng >= {NUMBER} and lng <= {NUMBER}")
+
+
+@pytest.mark.parametrize("region", [
+    BBoxRegion(38.5, -90.4, 38.8, -90.1),
+    CircleRegion(33.75, -84.39, 5_000),
+    PolygonRegion([(33.7, -84.4), (33.8, -84.4), (33.8, -84.3)]),
+], ids=["bbox", "circle", "polygon"])
+def test_milvus_expr_is_numeric(region):
+    assert EXPR.fullmatch(region.milvus_expr()), region.milvus_expr()
+    assert all(type(v) is float for v in region.bbox())
+
+
+class FakeGeocoder:
+    """Stands in for the `requests` module: answers with `statuses` in turn."""
+
+    def __init__(self, *statuses):
+        self.statuses = list(statuses)
+        self.calls = 0
+
+    def get(self, url, params=None, timeout=None):
+        self.calls += 1
+        status = self.statuses.pop(0)
+        return SimpleNamespace(json=lambda: {"status": status, "results": []})
+
+
+@pytest.mark.parametrize("status, calls", [("ZERO_RESULTS", 1), ("OVER_QUERY_LIMIT", 2), ("REQUEST_DENIED", 2)])
+def test_city_resolver_caches_only_definitive_misses(monkeypatch, status, calls):
+    geocoder = FakeGeocoder(status, status)
+    monkeypatch.setitem(sys.modules, "requests", geocoder)
+    resolver = CityBoundsResolver(api_key="test")
+    assert resolver.resolve("Nowhere") is None
+    assert resolver.resolve("nowhere") is None
+    assert geocoder.calls == calls
@@ -0,0 +1,43 @@
+# 1-D GMM used by the GMM score filter vs sklearn's GaussianMixture
+#
+#   python -m pytest util/test_index/test_mixture_1d.py
+
+import sys
+import os
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import numpy as np
+import pytest
+from scipy.special import ndtri
+from mixture_1d import fit_gmm_1d
+
+PERCENTILE = 0.8
+
+
+def top_threshold(weights, means, variances):
+    top = np.argmax(means)
+    return means[top] + np.sqrt(variances[top]) * ndtri(PERCENTILE)
+
+
+def skewed_scores(seed):
+    # A large low-scoring bulk and a small, well separated top cluster
+    rng = np.random.default_rng(seed)
+    return np.concatenate([rng.normal(0.10, 0.02, 2200), rng.normal(0.25, 0.03, 220),
+                           rng.normal(0.45, 0.02, 80)])
+
+
+@pytest.mark.parametrize("seed", range(4))
+def test_matches_sklearn_on_skewed_scores(seed):
+    mixture = pytest.importorskip("sklearn.mixture")
+    x = skewed_scores(seed)
+    gmm = mixture.GaussianMixture(n_components=3, n_init=10, random_state=42).fit(x[:, None])
+    expected = top_threshold(gmm.weights_, gmm.means_.ravel(), gmm.covariances_.ravel())
+    assert top_threshold(*fit_gmm_1d(x, 3)) == pytest.approx(expected, rel=1e-3)
+
+
+def test_fit_only_depends_on_the_data():
+    a, b = skewed_scores(0), skewed_scores(1)
+    first = fit_gmm_1d(a, 3)
+    fit_gmm_1d(b, 3)
+    for p, q in zip(first, fit_gmm_1d(a, 3)):
+        np.testing.assert_array_equal(p, q)
@@ -0,0 +1,64 @@
+# parity check: geohash-sharded search vs one unsharded local index
+#
+#   python -m pytest util/test_index/test_sharded_index.py
+
+import sys
+import os
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import numpy as np
+import pytest
+from geo import BBoxRegion, CircleRegion
+from sharded_index import ShardedSearchBackend, build_sharded_index
+from vector_index import LocalSearchBackend, coordinates_from_ids, save_local_index
+
+N_LOCATIONS = 3000
+DIM = 32
+TOP_K = 50
+
+
+@pytest.fixture(scope="module")
+def backends(tmp_path_factory):
+    rng = np.random.default_rng(0)
+    # Spread over a few geohash-3 cells around Atlanta
+    lat = rng.uniform(33.0, 34.5, N_LOCATIONS)
+    lng = rng.uniform(-85.0, -83.5, N_LOCATIONS)
+    ids = np.array([f"{a:.6f}_{b:.6f}" for a, b in zip(lat, lng)])
+    embeddings = rng.standard_normal((N_LOCATIONS, DIM)).astype(np.float32)
+    embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True)
+
+    root = tmp_path_factory.mktemp("index")
+    save_local_index(str(root / "flat" / "index"), ids, embeddings)
+    flat = LocalSearchBackend.from_prefix(str(root / "flat" / "index"))
+    manifest = build_sharded_index(str(root / "shards"), ids, embeddings, np.column_stack([flat.lat, flat.lng]))
+    assert len(manifest) > 1
+    sharded = ShardedSearchBackend(str(root / "shards"), workers=2)
+
+    queries = rng.standard_normal((4, DIM)).astype(np.float32)
+    queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+    return flat, sharded, queries
+
+
+@pytest.mark.parametrize("region", [
+    None,
+    BBoxRegion(33.4, -84.6, 34.1, -83.9),
+    CircleRegion(33.75, -84.39, 30_000),
+], ids=["unbounded", "bbox", "circle"])
+def test_sharded_matches_unsharded(backends, region):
+    flat, sharded, queries = backends
+    expected = flat.search(queries, TOP_K, region=region)
+    actual = sharded.search(queries, TOP_K, region=region)
+    for want, got in zip(expected, actual):
+        assert len(got.ids) == len(want.ids) == TOP_K
+        np.testing.assert_allclose(got.scores, want.scores, rtol=1e-5, atol=1e-6)
+        assert set(got.ids) == set(want.ids)
+        # ids come back with their own coordinates, not another shard's row
+        np.testing.assert_array_equal(got.lat, np.array([float(i.split("_")[0]) for i in got.ids]))
+
+
+@pytest.mark.parametrize("ids", [[], ["33.75_-84.39", "not-an-id"]], ids=["empty", "malformed"])
+def test_coordinates_from_ids(ids):
+    lat, lng = coordinates_from_ids(np.array(ids, dtype=str))
+    assert lat.shape == lng.shape == (len(ids),)
+    if ids:
+        assert (lat[0], lng[0]) == (33.75, -84.39) and np.isnan(lat[1])
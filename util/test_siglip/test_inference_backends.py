@@ -0,0 +1,99 @@
+# parity + latency/memory check of the CPU inference backends against fp32 eager
+#
+#   python -m pytest util/test_siglip/test_inference_backends.py   (downloads the models)
+#   python util/test_siglip/test_inference_backends.py [model]     (also prints latency / RSS)
+
+import sys
+import os
+import time
+# Use util/feature_extractors.py, not the older copy next to this script
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import pytest
+import torch
+from feature_extractors import FeatureExtractorFactory, INFERENCE_BACKENDS
+
+MODEL_NAME = "google/siglip2-base-patch16-512"
+# Hugging Face extractors the backends apply to
+MODELS = [
+    MODEL_NAME,
+    "openai/clip-vit-base-patch32",
+]
+
+PROMPTS = [
+    "school",
+    "public park greenspace",
+    "residential suburban neighborhood",
+    "school education community center",
+    "quiet street near a grocery store",
+    "bus stop",
+]
+
+# Minimum cosine to the fp32 eager embedding of the same prompt
+MIN_COSINE = {
+    "eager": 0.995,  # autocast (bf16 on CPU)
+    "int8": 0.98,    # dynamic int8 weights
+    "onnx": 0.9999,  # same fp32 graph, different runtime
+}
+
+N_RUNS = 20
+
+
+def rss_mb() -> float:
+    """Resident set size of this process in MB (Linux)."""
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+
+
+def time_encode(extractor, texts, n_runs=N_RUNS):
+    extractor.extract_text_features(texts)  # warm-up
+    start = time.perf_counter()
+    for _ in range(n_runs):
+        extractor.extract_text_features(texts)
+    return (time.perf_counter() - start) / n_runs * 1000
+
+
+def fp32_reference(model_name, device):
+    # fp32 reference: eager model with autocast off
+    extractor = FeatureExtractorFactory.create_extractor(model_name, device)
+    extractor.autocast_enabled = False
+    return extractor.extract_text_features(PROMPTS).float()
+
+
+@pytest.fixture(scope="module", params=MODELS)
+def reference(request):
+    return request.param, fp32_reference(request.param, torch.device("cpu"))
+
+
+@pytest.mark.parametrize("backend", INFERENCE_BACKENDS)
+def test_backend_matches_fp32(reference, backend):
+    if backend == "onnx":
+        pytest.importorskip("onnxruntime")
+    model_name, expected = reference
+    extractor = FeatureExtractorFactory.create_extractor(model_name, torch.device("cpu"), backend=backend)
+    embeds = extractor.extract_text_features(PROMPTS).float()
+    min_cosine = (expected * embeds).sum(dim=-1).min().item()
+    assert min_cosine >= MIN_COSINE[backend], f"{model_name} / {backend}: min cos = {min_cosine:.5f}"
+
+
+def main():
+    model_name = sys.argv[1] if len(sys.argv) > 1 else MODEL_NAME
+    device = torch.device("cpu")
+    reference = fp32_reference(model_name, device)
+
+    for backend in INFERENCE_BACKENDS:
+        before = rss_mb()
+        extractor = FeatureExtractorFactory.create_extractor(model_name, device, backend=backend)
+        loaded = rss_mb() - before
+
+        embeds = extractor.extract_text_features(PROMPTS).float()
+        latency = time_encode(extractor, PROMPTS)
+        max_abs_diff = (reference - embeds).abs().max().item()
+        min_cosine = (reference * embeds).sum(dim=-1).min().item()
+        print(f"{backend:>6}: {latency:7.1f} ms/batch  +{loaded:7.1f} MB RSS  "
+              f"max |Δ| = {max_abs_diff:.2e}  min cos = {min_cosine:.5f}")
+        del extractor
+
+
+if __name__ == "__main__":
+    main()
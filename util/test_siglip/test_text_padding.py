@@ -0,0 +1,92 @@
+# parity check: padding="max_length" vs length-bucketed "longest" padding
+#
+#   python -m pytest util/test_siglip/test_text_padding.py   (downloads the models)
+#   python util/test_siglip/test_text_padding.py             (also prints CPU latency)
+
+import sys
+import os
+import time
+# Use util/feature_extractors.py, not the older copy next to this script
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import pytest
+import torch
+from feature_extractors import FeatureExtractorFactory
+
+# "longest" is only offered where it is exact: CLIP's causal attention and EOS
+# pooling never look at trailing pads
+LONGEST_PADDING_MODELS = [
+    "openai/clip-vit-base-patch32",
+]
+# SigLIP pools the last position without an attention mask, so they reject it
+MAX_LENGTH_ONLY_MODELS = [
+    "google/siglip-base-patch16-224",
+    "google/siglip2-base-patch16-512",
+]
+
+PROMPTS = [
+    "school",
+    "public park greenspace",
+    "residential suburban neighborhood",
+    "school education community center",
+    "quiet street near a grocery store",
+    "safe neighborhood near a park near public park greenspace",
+    "bus stop",
+    "apartment buildings near bars and restaurants within walking distance",
+]
+
+TOLERANCE = 1e-3
+N_RUNS = 20
+
+
+def encode_both(extractor, texts):
+    # fp32 on both sides, so only the padding differs
+    extractor.autocast_enabled = False
+    extractor.text_padding = "max_length"
+    reference = extractor.extract_text_features(texts).float()
+    extractor.text_padding = "longest"
+    dynamic = extractor.extract_text_features(texts).float()
+    return reference, dynamic
+
+
+@pytest.mark.parametrize("model_name", LONGEST_PADDING_MODELS)
+def test_longest_padding_matches_max_length(model_name):
+    extractor = FeatureExtractorFactory.create_extractor(model_name, torch.device("cpu"))
+    reference, dynamic = encode_both(extractor, PROMPTS)
+    max_abs_diff = (reference - dynamic).abs().max().item()
+    assert max_abs_diff <= TOLERANCE, f"{model_name}: max |Δ| = {max_abs_diff:.2e}"
+
+
+@pytest.mark.parametrize("model_name", MAX_LENGTH_ONLY_MODELS)
+def test_siglip_rejects_longest_padding(model_name):
+    with pytest.raises(ValueError):
+        FeatureExtractorFactory.create_extractor(model_name, torch.device("cpu"), text_padding="longest")
+
+
+def time_encode(extractor, texts, n_runs=N_RUNS):
+    extractor.extract_text_features(texts)  # warm-up
+    start = time.perf_counter()
+    for _ in range(n_runs):
+        extractor.extract_text_features(texts)
+    return (time.perf_counter() - start) / n_runs * 1000
+
+
+def main():
+    device = torch.device("cpu")
+    for model_name in sys.argv[1:] or LONGEST_PADDING_MODELS:
+        extractor = FeatureExtractorFactory.create_extractor(model_name, device)
+        reference, dynamic = encode_both(extractor, PROMPTS)
+        max_abs_diff = (reference - dynamic).abs().max().item()
+        status = "✅ parity" if max_abs_diff <= TOLERANCE else "⚠️  differs"
+        print(f"{model_name}: {status} (max |Δ| = {max_abs_diff:.2e})")
+
+        extractor.text_padding = "max_length"
+        max_length_ms = time_encode(extractor, PROMPTS)
+        extractor.text_padding = "longest"
+        longest_ms = time_encode(extractor, PROMPTS)
+        print(f"    max_length: {max_length_ms:.1f} ms  longest: {longest_ms:.1f} ms  "
+              f"speed-up: {max_length_ms / longest_ms:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,455 @@
+import os
+import threading
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+from geo import GeoRegion
+
+
+class SearchHits(NamedTuple):
+    """One result set per query, sorted by descending score (lat/lng NaN if unknown)."""
+    ids: np.ndarray
+    scores: np.ndarray
+    lat: np.ndarray
+    lng: np.ndarray
+
+
+def _top_k_rows(scores: np.ndarray, top_k: int) -> np.ndarray:
+    """Indices of the `top_k` largest entries of a 1-D score vector, best first."""
+    k = min(top_k, scores.shape[0])
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    if k < scores.shape[0]:
+        idx = np.argpartition(scores, -k)[-k:]
+    else:
+        idx = np.arange(scores.shape[0])
+    return idx[np.argsort(-scores[idx], kind="stable")]
+
+
+def coordinates_from_ids(ids: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    (lat, lng) float64 vectors from `{lat}_{lng}` ids; NaN where an id does not parse.
+    """
+    ids = np.asarray(ids, dtype=str)
+    if ids.size == 0:
+        # np.char.partition raises on an empty array under NumPy 2
+        return np.empty(0, dtype=np.float64), np.empty(0, dtype=np.float64)
+    parts = np.char.partition(ids, "_")
+    try:
+        return parts[:, 0].astype(np.float64), parts[:, 2].astype(np.float64)
+    except ValueError:
+        # Some id is malformed: fall back to parsing one by one
+        lat = np.full(ids.shape[0], np.nan)
+        lng = np.full(ids.shape[0], np.nan)
+        for i, (a, _, b) in enumerate(parts):
+            try:
+                lat[i], lng[i] = float(a), float(b)
+            except ValueError:
+                pass
+        return lat, lng
+
+
+# --------------------------------------------------------------------------- #
+# Abstract base
+# --------------------------------------------------------------------------- #
+class BaseSearchBackend(ABC):
+    """Inner-product vector search over the street-view embedding corpus."""
+
+    @abstractmethod
+    def search(self, query_embeddings: np.ndarray, top_k: int,
+               region: Optional[GeoRegion] = None) -> List[SearchHits]:
+        """
+        Args:
+            query_embeddings: (n_queries, dim) float32, L2-normalised
+            top_k: Number of hits per query
+            region: Only return locations inside this area (see util/geo.py)
+
+        Returns:
+            One SearchHits per query, best first
+        """
+        ...
+
+    # Whether `dense_search(query_embeddings, region=None)` is available: score
+    # every location (inside `region`) against every query, one SearchHits per
+    # query covering all locations in index order, unsorted
+    supports_dense_search = False
+
+
+# --------------------------------------------------------------------------- #
+# Zilliz / Milvus
+# --------------------------------------------------------------------------- #
+COORDINATE_FIELDS = ("lat", "lng")
+
+
+class ZillizSearchBackend(BaseSearchBackend):
+    """
+    Search through a loaded pymilvus `Collection` (HNSW, IP metric).
+
+    If the schema has numeric `lat`/`lng` fields they are returned with the
+    hits and geo-bounded searches become a scalar bbox prefilter inside Milvus;
+    otherwise coordinates are parsed from the `{lat}_{lng}` ids and the region
+    is ignored (with a warning): post-filtering a plain top_k would leave few
+    hits in the region, and oversampling multiplies the cost of every search.
+    """
+
+    def __init__(self, collection, ef: int = 128):
+        self.collection = collection
+        self.search_params = {
+            "metric_type": "IP",  # Inner Product for normalized embeddings
+            "params": {"ef": ef}
+        }
+        fields = {field.name for field in collection.schema.fields}
+        self.has_coordinates = all(name in fields for name in COORDINATE_FIELDS)
+        self._warned_unbounded = False
+
+    def search(self, query_embeddings: np.ndarray, top_k: int,
+               region: Optional[GeoRegion] = None) -> List[SearchHits]:
+        if region is not None and not self.has_coordinates:
+            if not self._warned_unbounded:
+                print("⚠️  Collection has no lat/lng fields, geo bounds are ignored (searching unbounded)")
+                self._warned_unbounded = True
+            region = None
+        results = self.collection.search(
+            data=query_embeddings.tolist(),
+            anns_field="embedding",
+            param=self.search_params,
+            limit=top_k,
+            expr=region.milvus_expr() if region is not None else None,
+            # ✅ ONLY include fields that exist in the schema
+            output_fields=["id", *COORDINATE_FIELDS] if self.has_coordinates else ["id"]
+        )
+        out = []
+        for hits in results:
+            ids = np.array([hit.id for hit in hits], dtype=object)
+            scores = np.array([hit.score for hit in hits], dtype=np.float32)
+            if self.has_coordinates:
+                lat = np.array([hit.entity.get("lat") for hit in hits], dtype=np.float64)
+                lng = np.array([hit.entity.get("lng") for hit in hits], dtype=np.float64)
+            else:
+                lat, lng = coordinates_from_ids(ids)
+            hits = SearchHits(ids, scores, lat, lng)
+            if region is not None:
+                # bbox prefilter is conservative; exact test for circles/polygons
+                keep = np.flatnonzero(region.contains(lat, lng))[:top_k]
+                hits = SearchHits(*(column[keep] for column in hits))
+            out.append(hits)
+        return out
+
+
+# --------------------------------------------------------------------------- #
+# Local, in-process index
+# --------------------------------------------------------------------------- #
+def save_local_index(prefix: str, ids, embeddings: np.ndarray, dtype=np.float16):
+    """
+    Write a local index as `{prefix}.embeddings.npy` + `{prefix}.ids.npy` +
+    `{prefix}.coords.npy`.
+
+    Embeddings are stored contiguous in `dtype` (float16 halves RAM and disk);
+    rows are expected to be L2-normalised. Coordinates are parsed from the
+    `{lat}_{lng}` ids once here, as an (N, 2) float64 array.
+
+    Every file is written to a temporary name and swapped in with os.replace,
+    so a server that has the old files memory-mapped keeps reading the old
+    inodes instead of a half-written file.
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(prefix)), exist_ok=True)
+    ids = np.asarray(ids, dtype=str)
+    _save_atomic(f"{prefix}.embeddings.npy", np.ascontiguousarray(embeddings, dtype=dtype))
+    _save_atomic(f"{prefix}.coords.npy", np.column_stack(coordinates_from_ids(ids)))
+    _save_atomic(f"{prefix}.ids.npy", ids)
+
+
+def _save_atomic(path: str, array: np.ndarray):
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:  # a file handle, so np.save doesn't append ".npy"
+        np.save(f, array)
+    os.replace(tmp, path)
+
+
+class IVFIndex:
+    """
+    Inverted-file approximate index (spherical k-means coarse quantiser).
+
+    Rows are grouped by nearest centroid into a CSR layout (`order`, `offsets`),
+    so a query only scores the rows of its `nprobe` closest lists.
+    """
+
+    def __init__(self, centroids: np.ndarray, order: np.ndarray, offsets: np.ndarray):
+        self.centroids = centroids
+        self.order = order
+        self.offsets = offsets
+
+    @property
+    def nlist(self) -> int:
+        return self.centroids.shape[0]
+
+    @classmethod
+    def train(cls, embeddings: np.ndarray, nlist: int = 256, n_iter: int = 10,
+              sample_size: int = 50000, chunk_size: int = 65536, seed: int = 0) -> "IVFIndex":
+        rng = np.random.default_rng(seed)
+        n = embeddings.shape[0]
+        nlist = max(1, min(nlist, n))
+        sample_idx = rng.choice(n, size=min(sample_size, n), replace=False)
+        sample = np.asarray(embeddings[np.sort(sample_idx)], dtype=np.float32)
+
+        centroids = sample[rng.choice(sample.shape[0], size=nlist, replace=False)].copy()
+        for _ in range(n_iter):
+            assign = np.argmax(sample @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assign, sample)
+            counts = np.bincount(assign, minlength=nlist)
+            # Keep the previous centroid for empty clusters
+            nonempty = counts > 0
+            centroids[nonempty] = sums[nonempty]
+            centroids /= np.maximum(np.linalg.norm(centroids, axis=1, keepdims=True), 1e-12)
+
+        assign = np.empty(n, dtype=np.int32)
+        for start in range(0, n, chunk_size):
+            chunk = np.asarray(embeddings[start:start + chunk_size], dtype=np.float32)
+            assign[start:start + chunk_size] = np.argmax(chunk @ centroids.T, axis=1)
+        order = np.argsort(assign, kind="stable").astype(np.int64)
+        offsets = np.zeros(nlist + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(np.bincount(assign, minlength=nlist))
+        return cls(centroids, order, offsets)
+
+    def candidates(self, query: np.ndarray, nprobe: int) -> np.ndarray:
+        """Row indices belonging to the `nprobe` lists closest to `query`."""
+        probe = _top_k_rows(self.centroids @ query, nprobe)
+        return np.concatenate([self.order[self.offsets[c]:self.offsets[c + 1]] for c in probe])
+
+    def save(self, path: str):
+        tmp = path + ".tmp"
+        with open(tmp, "wb") as f:
+            np.savez(f, centroids=self.centroids, order=self.order, offsets=self.offsets)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: str) -> "IVFIndex":
+        data = np.load(path)
+        return cls(data["centroids"], data["order"], data["offsets"])
+
+
+class SpatialGrid:
+    """
+    Rows bucketed by lat/lng grid cell in a CSR layout (`order`, `offsets`),
+    so a geo-bounded search only touches the rows of the cells it overlaps.
+    """
+
+    def __init__(self, lat: np.ndarray, lng: np.ndarray, cell_deg: float = 0.05):
+        self.cell_deg = cell_deg
+        valid = np.flatnonzero(np.isfinite(lat) & np.isfinite(lng))
+        cell_ij = np.floor(np.column_stack([lat[valid], lng[valid]]) / cell_deg).astype(np.int64)
+        self.cells, inverse = np.unique(cell_ij, axis=0, return_inverse=True)
+        inverse = inverse.ravel()
+        self.order = valid[np.argsort(inverse, kind="stable")]
+        self.offsets = np.zeros(len(self.cells) + 1, dtype=np.int64)
+        self.offsets[1:] = np.cumsum(np.bincount(inverse, minlength=len(self.cells)))
+
+    def rows_in_bbox(self, bbox) -> np.ndarray:
+        """Rows of every cell overlapping `bbox` (a superset of the rows inside it)."""
+        min_lat, min_lng, max_lat, max_lng = bbox
+        i0, j0 = np.floor(np.array([min_lat, min_lng]) / self.cell_deg).astype(np.int64)
+        i1, j1 = np.floor(np.array([max_lat, max_lng]) / self.cell_deg).astype(np.int64)
+        hit = np.flatnonzero((self.cells[:, 0] >= i0) & (self.cells[:, 0] <= i1) &
+                             (self.cells[:, 1] >= j0) & (self.cells[:, 1] <= j1))
+        if len(hit) == 0:
+            return np.empty(0, dtype=np.int64)
+        # Concatenate the selected CSR slices without a Python loop
+        starts, lengths = self.offsets[hit], self.offsets[hit + 1] - self.offsets[hit]
+        shift = np.repeat(starts - np.concatenate([[0], np.cumsum(lengths)[:-1]]), lengths)
+        return self.order[np.arange(lengths.sum()) + shift]
+
+
+class DenseField:
+    """
+    Resident, contiguous embedding matrix of one area (a city, or the whole
+    index) scored exhaustively: every location against a batch of queries.
+
+    float32 fields are scored with a single GEMM. float16 fields (half the RAM)
+    are upcast in row blocks, since NumPy has no native float16 GEMM; each
+    block is still one GEMM over all queries.
+    """
+
+    def __init__(self, embeddings: np.ndarray, ids: np.ndarray, lat: np.ndarray, lng: np.ndarray,
+                 dtype=np.float16, block_rows: int = 65536, shared_columns: bool = False):
+        self.matrix = np.ascontiguousarray(embeddings, dtype=dtype)
+        # An in-memory matrix that is already contiguous in `dtype` is used as is
+        self.owns_matrix = not np.may_share_memory(self.matrix, embeddings)
+        self.ids, self.lat, self.lng = ids, lat, lng
+        self.shared_columns = shared_columns  # ids/lat/lng are the source's own arrays
+        self.block_rows = block_rows
+
+    def __len__(self) -> int:
+        return self.matrix.shape[0]
+
+    @property
+    def nbytes(self) -> int:
+        """Memory held by this field on top of its source matrix."""
+        extra = self.matrix.nbytes if self.owns_matrix else 0
+        if not self.shared_columns:
+            extra += self.ids.nbytes + self.lat.nbytes + self.lng.nbytes
+        return int(extra)
+
+    def score(self, query_embeddings: np.ndarray) -> np.ndarray:
+        """(n_queries, n_locations) float32 inner products."""
+        queries = np.asarray(query_embeddings, dtype=np.float32)
+        if self.matrix.dtype == np.float32:
+            return queries @ self.matrix.T
+        scores = np.empty((queries.shape[0], len(self)), dtype=np.float32)
+        for start in range(0, len(self), self.block_rows):
+            block = self.matrix[start:start + self.block_rows].astype(np.float32)
+            scores[:, start:start + block.shape[0]] = queries @ block.T
+        return scores
+
+    def hits(self, query_embeddings: np.ndarray) -> List[SearchHits]:
+        return [SearchHits(self.ids, scores, self.lat, self.lng) for scores in self.score(query_embeddings)]
+
+
+class LocalSearchBackend(BaseSearchBackend):
+    """
+    Exact (or IVF-approximate) inner-product search over a memory-mapped matrix.
+
+    The embedding matrix is opened with `mmap_mode="r"`, so several worker
+    processes share the same page cache instead of each holding a copy.
+
+    Geo-bounded searches score only the rows of the region (via a SpatialGrid
+    over the coordinates), so their cost scales with the region size.
+
+    Full-field searches (`dense_search`) keep a DenseField per area resident
+    (LRU of `dense_fields` areas) and score all of its locations at once.
+    """
+
+    supports_dense_search = True
+
+    def __init__(self, embeddings: np.ndarray, ids: np.ndarray,
+                 ivf: Optional[IVFIndex] = None, nprobe: int = 16, chunk_size: int = 65536,
+                 coords: Optional[np.ndarray] = None):
+        if embeddings.shape[0] != ids.shape[0]:
+            raise ValueError(f"Index has {embeddings.shape[0]} embeddings but {ids.shape[0]} ids")
+        self.embeddings = embeddings
+        self.ids = ids
+        # (N, 2) lat/lng per row, so hits are a gather instead of id parsing
+        if coords is None:
+            coords = np.column_stack(coordinates_from_ids(ids))
+        self.lat = np.ascontiguousarray(coords[:, 0])
+        self.lng = np.ascontiguousarray(coords[:, 1])
+        self.ivf = ivf
+        self.nprobe = nprobe
+        self.chunk_size = chunk_size
+        self.grid = SpatialGrid(self.lat, self.lng)
+
+        self.dense_dtype = np.dtype(os.getenv("PLANIT_DENSE_DTYPE", "float16"))
+        self.dense_fields = int(os.getenv("PLANIT_DENSE_FIELDS", "4"))
+        self._fields: "OrderedDict[str, DenseField]" = OrderedDict()
+        self._fields_lock = threading.Lock()
+
+    @classmethod
+    def from_prefix(cls, prefix: str, nprobe: int = 16, mmap: bool = True) -> "LocalSearchBackend":
+        """
+        Open `{prefix}.embeddings.npy` / `{prefix}.ids.npy` (+ optional
+        `{prefix}.coords.npy` and `{prefix}.ivf.npz`; older indexes without
+        coords.npy have their ids parsed once here).
+        `mmap=False` reads the embeddings into memory instead of mapping them.
+        """
+        embeddings = np.load(f"{prefix}.embeddings.npy", mmap_mode="r" if mmap else None)
+        ids = np.load(f"{prefix}.ids.npy")
+        coords_path = f"{prefix}.coords.npy"
+        coords = np.load(coords_path) if os.path.exists(coords_path) else None
+        ivf_path = f"{prefix}.ivf.npz"
+        ivf = IVFIndex.load(ivf_path) if os.path.exists(ivf_path) else None
+        return cls(embeddings, ids, ivf=ivf, nprobe=nprobe, coords=coords)
+
+    def __len__(self) -> int:
+        return self.embeddings.shape[0]
+
+    def score_all(self, query_embeddings: np.ndarray) -> np.ndarray:
+        """Exact scores of every row against every query, shape (n_queries, n_rows)."""
+        queries = np.asarray(query_embeddings, dtype=np.float32)
+        scores = np.empty((queries.shape[0], len(self)), dtype=np.float32)
+        # Upcast in chunks so a float16 matrix never needs a full float32 copy
+        for start in range(0, len(self), self.chunk_size):
+            chunk = np.asarray(self.embeddings[start:start + self.chunk_size], dtype=np.float32)
+            scores[:, start:start + chunk.shape[0]] = queries @ chunk.T
+        return scores
+
+    def region_rows(self, region: GeoRegion) -> np.ndarray:
+        """Sorted row indices of the locations inside `region`."""
+        rows = np.sort(self.grid.rows_in_bbox(region.bbox()))
+        return rows[region.contains(self.lat[rows], self.lng[rows])]
+
+    def score_rows(self, query_embeddings: np.ndarray, rows: np.ndarray) -> np.ndarray:
+        """Exact scores of `rows` against every query, shape (n_queries, len(rows))."""
+        queries = np.asarray(query_embeddings, dtype=np.float32)
+        scores = np.empty((queries.shape[0], len(rows)), dtype=np.float32)
+        for start in range(0, len(rows), self.chunk_size):
+            chunk = np.asarray(self.embeddings[rows[start:start + self.chunk_size]], dtype=np.float32)
+            scores[:, start:start + chunk.shape[0]] = queries @ chunk.T
+        return scores
+
+    def dense_field(self, region: Optional[GeoRegion] = None) -> DenseField:
+        """Resident DenseField of `region` (the whole index when None), built on first use."""
+        key = region.key() if region is not None else "*"
+        with self._fields_lock:
+            field = self._fields.get(key)
+            if field is not None:
+                self._fields.move_to_end(key)
+                return field
+        if region is None:
+            field = DenseField(self.embeddings, self.ids, self.lat, self.lng, dtype=self.dense_dtype,
+                               shared_columns=True)
+        else:
+            rows = self.region_rows(region)
+            field = DenseField(self.embeddings[rows], self.ids[rows], self.lat[rows], self.lng[rows],
+                               dtype=self.dense_dtype)
+        with self._fields_lock:
+            self._fields[key] = field
+            self._fields.move_to_end(key)
+            while len(self._fields) > self.dense_fields:
+                self._fields.popitem(last=False)
+        return field
+
+    @property
+    def dense_bytes(self) -> int:
+        """Memory held by the resident dense fields."""
+        with self._fields_lock:
+            return sum(field.nbytes for field in self._fields.values())
+
+    def dense_search(self, query_embeddings: np.ndarray,
+                     region: Optional[GeoRegion] = None) -> List[SearchHits]:
+        return self.dense_field(region).hits(query_embeddings)
+
+    def _hits(self, rows: np.ndarray, scores: np.ndarray) -> SearchHits:
+        return SearchHits(self.ids[rows], scores, self.lat[rows], self.lng[rows])
+
+    def search(self, query_embeddings: np.ndarray, top_k: int,
+               region: Optional[GeoRegion] = None) -> List[SearchHits]:
+        queries = np.asarray(query_embeddings, dtype=np.float32)
+        if region is not None:
+            # Exact search restricted to the region's rows: a city-sized region
+            # is small enough that this beats probing the global IVF lists
+            rows = self.region_rows(region)
+            out = []
+            for scores in self.score_rows(queries, rows):
+                best = _top_k_rows(scores, top_k)
+                out.append(self._hits(rows[best], scores[best]))
+            return out
+
+        if self.ivf is not None:
+            out = []
+            for query in queries:
+                # Sorted row order keeps memory-mapped reads sequential
+                rows = np.sort(self.ivf.candidates(query, self.nprobe))
+                scores = np.asarray(self.embeddings[rows], dtype=np.float32) @ query
+                best = _top_k_rows(scores, top_k)
+                out.append(self._hits(rows[best], scores[best]))
+            return out
+
+        all_scores = self.score_all(queries)
+        out = []
+        for scores in all_scores:
+            best = _top_k_rows(scores, top_k)
+            out.append(self._hits(best, scores[best]))
+        return out